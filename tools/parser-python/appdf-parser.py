@@ -1,4 +1,6 @@
+import os
 import json
+import threading
 from zipfile import ZipFile
 from lxml import etree
 
@@ -6,6 +8,10 @@ __DEFAULT_APPDF_LANGUAGE = 'en'
 __ICONS_RESOLUTIONS = [(512, 512)]
 __SCREENSHOT_SIDE_SIZE_MIN = 240
 __SCREENSHOT_SIDE_SIZE_MAX = 1920
+__SCHEMA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', '..', 'specification', 'appdf-description.xsd')
+__COUNTRIES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', '..', 'specification', 'data', 'countries.json')
 
 
 def __parse_categorization(product, categorization_node):
@@ -120,7 +126,16 @@ def __parse_description(product, whats_new, description_node, is_default):
 
 
 def __get_countries():
-    countries = set(json.load(countries_file).keys())
+    """
+    Loads lower-cased country codes at first call and returns cached value at further calls
+    """
+    try:
+        return __get_countries.countries
+    except AttributeError:
+        with open(__COUNTRIES_PATH, 'r') as countries_file:
+            __get_countries.countries = frozenset(
+                    code.lower() for code in json.load(countries_file).keys())
+        return __get_countries.countries
 
 
 def __parse_availability(product, availability_node):
@@ -169,6 +184,20 @@ def __parse_apk_files(product, apk_files_node):
     return apk_files
 
 
+def __check_files(product, appdf):
+    """
+    Checks that files to upload are present in AppDF.
+    Only zip central directory is used, no file is read.
+    """
+    file_names = [file_name for kind, file_name in product['images_to_upload']]
+    file_names.extend(product.get('builds', []))
+    for file_name in file_names:
+        try:
+            appdf.getinfo(file_name)
+        except KeyError:
+            raise Exception('There is no %s mentioned in description.xml in AppDF.' % file_name)
+
+
 def __parse_application(app_node, appdf):
     """
     Parses an application described by XML node.
@@ -209,21 +238,49 @@ def __parse_application(app_node, appdf):
     apk_files_node = app_node.find('apk-files')
     if apk_files_node is not None:
         product['builds'] = __parse_apk_files(product, apk_files_node)
+
+    __check_files(product, appdf)
     return product
 
 
-def __get_appdf_description_schema():
+def __get_appdf_description_schema(xsd_path=__SCHEMA_PATH):
     """
-    Loads appdf-description.xsd at first call and returns cached value at further calls
+    Compiles XML schema at first call and returns cached value at further calls.
+    Schemas are keyed by path and mtime, so an edited XSD is recompiled.
+    Returns (schema, lock) pair, validations by the schema must hold the lock
+    since its error log is not shared safely between them.
+    """
+    cache = __get_appdf_description_schema
+    path = os.path.realpath(xsd_path)
+    mtime = os.path.getmtime(path)
+    with cache.lock:
+        entry = cache.schemas.get(path)
+        if entry is not None and entry[0] == mtime:
+            cache.hits += 1
+            return entry[1:]
+        cache.misses += 1
+        schema = etree.XMLSchema(etree.parse(path))
+        cache.schemas[path] = (mtime, schema, threading.Lock())
+        return cache.schemas[path][1:]
+
+__get_appdf_description_schema.lock = threading.Lock()
+__get_appdf_description_schema.schemas = {}
+__get_appdf_description_schema.hits = 0
+__get_appdf_description_schema.misses = 0
+
+
+def schema_cache_stats():
+    cache = __get_appdf_description_schema
+    with cache.lock:
+        return {'hits': cache.hits, 'misses': cache.misses,
+                'schemas': len(cache.schemas)}
+
+
+def __open_description(file_name):
+    """
+    Opens AppDF zip and its description.xml.
+    Returns (appdf, description_file) pair.
     """
-    try:
-        return __get_appdf_description_schema.schema
-    except:
-        __get_appdf_description_schema.schema = etree.XMLSchema(etree.parse('appdf-description.xsd'))
-        return __get_appdf_description_schema.schema
-
-
-def parse_appdf(file_name):
     try:
         appdf = ZipFile(file_name, 'r')
     except:
@@ -232,14 +289,21 @@ def parse_appdf(file_name):
     try:
         description_file = appdf.open('description.xml')
     except KeyError:
+        appdf.close()
         raise Exception('There is no description.xml in AppDF.')
+    return appdf, description_file
+
+
+def parse_appdf(file_name):
+    appdf, description_file = __open_description(file_name)
     try:
         description = etree.parse(description_file)
     except SyntaxError, e:
         raise Exception('description.xml is invalid: %s.' % e.message)
-    description_schema = __get_appdf_description_schema()
+    description_schema, schema_lock = __get_appdf_description_schema()
     try:
-        description_schema.assertValid(description)
+        with schema_lock:
+            description_schema.assertValid(description)
     except Exception, e:
         raise Exception('description.xml does not match XML schema: %s' % e.message)
 
@@ -251,3 +315,40 @@ def parse_appdf(file_name):
 
     appdf.close()
     return products
+
+
+def iter_parse_appdf(file_name):
+    """
+    Streaming version of parse_appdf.
+    Yields product of each <application> as soon as its closing tag is read
+    and drops the parsed subtree, so only one application is held in memory.
+    Description is validated against XML schema while it is read, so products
+    of preceding applications may be yielded before a validation error.
+    """
+    appdf, description_file = __open_description(file_name)
+    description_schema, schema_lock = __get_appdf_description_schema()
+    has_products = False
+    try:
+        events = etree.iterparse(description_file, events=('end',),
+                                 tag='application', schema=description_schema)
+        while True:
+            # Validation runs while the next part of the file is parsed, the
+            # lock is not held while the product is used by the caller
+            with schema_lock:
+                try:
+                    event, application = next(events)
+                except StopIteration:
+                    break
+            product = __parse_application(application, appdf)
+            # Free the finished subtree and everything parsed before it
+            application.clear()
+            while application.getprevious() is not None:
+                del application.getparent()[0]
+            has_products = True
+            yield product
+    except etree.XMLSyntaxError, e:
+        raise Exception('description.xml is invalid or does not match XML schema: %s.' % e.message)
+    finally:
+        appdf.close()
+    if not has_products:
+        raise Exception('There are no applications in uploaded AppDF.')
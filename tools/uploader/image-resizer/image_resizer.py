@@ -1,12 +1,217 @@
 import os
 import sys
+import atexit
+import hashlib
+import tempfile
+import threading
 import subprocess
 
-def resize(input_path, output_path, width, height):
-    # path to the `image_resizer` executable
-    binary = os.path.abspath(os.path.join(sys.prefix, 'qtbin', 'image_resizer'))
+# path to the `image_resizer` executable
+BINARY = os.path.abspath(os.path.join(sys.prefix, 'qtbin', 'image_resizer'))
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".appdf", "images")
+HASH_CHUNK_SIZE = 1024 * 1024
+# jobs written to the worker ahead of its replies, small enough for pipe
+# buffers so that neither side blocks on a full pipe
+BATCH_WINDOW = 16
+# first line printed by `image_resizer --batch`, binaries built before
+# `--batch` take it for wrong arguments and print nothing to stdout
+BATCH_BANNER = "image_resizer batch"
+
+
+class ResizeError(Exception):
+    """ Raised when an image cannot be resized """
+
+
+def resize(input_path, output_path, width, height, binary=BINARY):
+    """ Resizes a single image by a new `image_resizer` process """
+    error = _resize_by_process(binary, input_path, output_path, width, height)
+    if error:
+        raise ResizeError("Cannot resize {}: {}".format(input_path, error))
+
+
+def _resize_by_process(binary, input_path, output_path, width, height):
+    """ Returns an error message or ``None`` """
     proc = subprocess.Popen([binary, input_path, output_path, str(width), str(height)],
                                     stdin  = subprocess.PIPE,
                                     stdout = subprocess.PIPE,
                                     stderr = subprocess.PIPE)
-    proc.wait()
\ No newline at end of file
+    out, err = proc.communicate()
+    if proc.returncode != 0 or not os.path.exists(output_path):
+        return err.strip() or "exit code {}".format(proc.returncode)
+    return None
+
+
+class Resizer(object):
+    """ Keeps one `image_resizer --batch` process alive and sends it batches
+    of jobs, so resizing many images does not start a process per image.
+    Binaries built before `--batch` was added get a process per image """
+
+    def __init__(self, binary=BINARY):
+        self.binary = binary
+        self.batch = True
+        self._proc = None
+        self._lock = threading.Lock()
+
+    def resize_many(self, jobs):
+        """ Resizes ``(input_path, output_path, width, height)`` jobs, returns
+        a list of error messages, ``None`` stands for success """
+        if not jobs:
+            return []
+        with self._lock:
+            try:
+                proc = self._worker()
+                if proc is not None:
+                    return self._resize_batch(proc, jobs)
+            except (IOError, OSError) as e:
+                self._close()
+                raise ResizeError("Image resizer failed: {}".format(e))
+            return self._resize_each(jobs)
+
+    def resize(self, input_path, output_path, width, height):
+        error = self.resize_many([(input_path, output_path, width, height)])[0]
+        if error:
+            raise ResizeError("Cannot resize {}: {}".format(input_path, error))
+
+    def _resize_batch(self, proc, jobs):
+        results = []
+        written = 0
+        while len(results) < len(jobs):
+            # Replies are read while jobs are written, at most BATCH_WINDOW
+            # jobs wait for their replies
+            while written < len(jobs) and written - len(results) < BATCH_WINDOW:
+                input_path, output_path, width, height = jobs[written]
+                proc.stdin.write("{}\t{}\t{}\t{}\n".format(
+                    _encode(input_path), _encode(output_path), width, height))
+                written += 1
+            proc.stdin.flush()
+            line = proc.stdout.readline()
+            if not line:
+                raise IOError("image_resizer exited")
+            line = line.strip()
+            results.append(None if line == "ok" else line[len("error "):])
+        return results
+
+    def _resize_each(self, jobs):
+        try:
+            return [_resize_by_process(self.binary, *job) for job in jobs]
+        except OSError as e:
+            raise ResizeError("Image resizer failed: {}".format(e))
+
+    def _worker(self):
+        """ Returns the worker process or ``None`` if the binary does not
+        support `--batch` """
+        if not self.batch:
+            return None
+        if self._proc is None or self._proc.poll() is not None:
+            self._close()
+            # Usage message of binaries without `--batch` is not shown
+            with open(os.devnull, "wb") as devnull:
+                self._proc = subprocess.Popen([self.binary, "--batch"],
+                                              stdin=subprocess.PIPE,
+                                              stdout=subprocess.PIPE,
+                                              stderr=devnull)
+            if self._proc.stdout.readline().strip() != BATCH_BANNER:
+                self._close()
+                self.batch = False
+                sys.stderr.write("{} does not support --batch, images are "
+                                 "resized by a process each until "
+                                 "image_resizer is rebuilt\n".format(self.binary))
+                return None
+        return self._proc
+
+    def _close(self):
+        """ Stops the worker process, returns its exit code """
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return None
+        try:
+            proc.stdin.close()
+        except IOError:
+            pass
+        return proc.wait()
+
+    def close(self):
+        """ Stops the worker process """
+        with self._lock:
+            self._close()
+
+
+class ResizeCache(object):
+    """ Resized images in `cache_dir` named by SHA-1 of the source image and
+    the target size, so an image is resized once for all publishes """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, resizer=None):
+        self.cache_dir = cache_dir
+        self.resizer = resizer or Resizer()
+        self._hashes = {}
+
+    def path(self, input_path, width, height):
+        """ Returns path of the resized image in the cache """
+        try:
+            source_hash = self._hash(input_path)
+        except (IOError, OSError) as e:
+            raise ResizeError("Cannot read {}: {}".format(input_path, e))
+        return os.path.join(self.cache_dir, "{}-{}x{}.png".format(
+            source_hash, width, height))
+
+    def resize_many(self, jobs):
+        """ Resizes ``(input_path, width, height)`` jobs missing in the cache
+        in one batch, returns paths of resized images """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        paths = [self.path(*job) for job in jobs]
+        missing = {}
+        for (input_path, width, height), path in zip(jobs, paths):
+            if not os.path.exists(path) and path not in missing:
+                fd, tmp_path = tempfile.mkstemp(suffix=".png", dir=self.cache_dir)
+                os.close(fd)
+                missing[path] = (input_path, tmp_path, width, height)
+        try:
+            errors = self.resizer.resize_many(missing.values())
+        except ResizeError:
+            for job in missing.values():
+                os.remove(job[1])
+            raise
+        failed = []
+        for (path, job), error in zip(missing.items(), errors):
+            if error:
+                os.remove(job[1])
+                failed.append("{}: {}".format(job[0], error))
+            else:
+                os.rename(job[1], path)
+        if failed:
+            raise ResizeError("Cannot resize " + ", ".join(failed))
+        return paths
+
+    def resize(self, input_path, width, height):
+        return self.resize_many([(input_path, width, height)])[0]
+
+    def _hash(self, input_path):
+        stat = os.stat(input_path)
+        key = (input_path, stat.st_size, stat.st_mtime)
+        if key not in self._hashes:
+            digest = hashlib.sha1()
+            with open(input_path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), ""):
+                    digest.update(chunk)
+            self._hashes[key] = digest.hexdigest()
+        return self._hashes[key]
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    """ Returns the ``ResizeCache`` shared by the process """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResizeCache()
+            atexit.register(_default_cache.resizer.close)
+        return _default_cache
+
+
+def _encode(path):
+    if isinstance(path, unicode):
+        return path.encode("utf-8")
+    return path
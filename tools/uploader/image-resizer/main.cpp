@@ -1,5 +1,24 @@
 #include <QtCore>
 #include <QImage>
+#include <cstdio>
+
+// Resizes an image, returns an error message or an empty string
+static QString resize(const QString &filepath, const QString &savepath,
+                      const QString &width, const QString &height)
+{
+    QImage img(filepath);
+    if (img.isNull()) {
+        return "No such file";
+    }
+    if (width.toUInt() == 0 || height.toUInt() == 0) {
+        return "Invalid size";
+    }
+    QImage small = img.scaled(width.toUInt(), height.toUInt(), Qt::IgnoreAspectRatio, Qt::SmoothTransformation);
+    if (!small.save(savepath)) {
+        return "Cannot save image";
+    }
+    return QString();
+}
 
 class Task : public QObject
 {
@@ -11,33 +30,51 @@ public slots:
     void run() {
         // Do processing here
         QStringList args = QCoreApplication::arguments();
-        if (args.size() != 5) {
-            qCritical() << "usage:" << args.at(0).toStdString().c_str() << "[image_path] [save_path] [new_width] [new_height]";
-            emit finished();
+        if (args.size() == 2 && args.at(1) == "--batch") {
+            runBatch();
             return;
         }
-        QString filepath = args.at(1);
-        QString savepath = args.at(2);
-        QString width = args.at(3);
-        QString height = args.at(4); 
-        QImage img(filepath);
-        if (img.isNull()) {
-            qCritical() << "No such file";
-            emit finished();
+        if (args.size() != 5) {
+            qCritical() << "usage:" << args.at(0).toStdString().c_str() << "[image_path] [save_path] [new_width] [new_height]";
+            qCritical() << "   or:" << args.at(0).toStdString().c_str() << "--batch";
+            QCoreApplication::exit(2);
             return;
         }
-        if (width.toUInt() == 0 || height.toUInt() == 0) {
-            qCritical() << "Invalid size";
-            emit finished();
+        QString error = resize(args.at(1), args.at(2), args.at(3), args.at(4));
+        if (!error.isEmpty()) {
+            qCritical() << error.toStdString().c_str();
+            QCoreApplication::exit(1);
             return;
         }
-        QImage small = img.scaled(width.toUInt(), height.toUInt(), Qt::IgnoreAspectRatio, Qt::SmoothTransformation);
-        small.save(savepath);
-        emit finished();
+        QCoreApplication::exit(0);
     }
 
-signals:
-    void finished();
+private:
+    // Prints "image_resizer batch", then reads
+    // "image_path\tsave_path\tnew_width\tnew_height" lines from stdin until
+    // it is closed and answers every line with "ok" or "error MESSAGE"
+    void runBatch() {
+        QTextStream in(stdin, QIODevice::ReadOnly);
+        QTextStream out(stdout, QIODevice::WriteOnly);
+        in.setCodec("UTF-8");
+        out.setCodec("UTF-8");
+        out << "image_resizer batch" << endl;
+        while (true) {
+            QString line = in.readLine();
+            if (line.isNull()) {
+                break;
+            }
+            QStringList job = line.split('\t');
+            QString error = job.size() == 4 ?
+                resize(job.at(0), job.at(1), job.at(2), job.at(3)) : QString("Invalid job");
+            if (error.isEmpty()) {
+                out << "ok" << endl;
+            } else {
+                out << "error " << error << endl;
+            }
+        }
+        QCoreApplication::exit(0);
+    }
 };
 
 #include "main.moc"
@@ -48,11 +85,8 @@ int main(int argc, char **argv) {
     // will be deleted by the application.
     Task *task = new Task(&app);
 
-    // This will cause the application to exit when
-    // the task signals finished.    
-    QObject::connect(task, SIGNAL(finished()), &app, SLOT(quit()));
-
-    // This will run the task from the application event loop.
+    // This will run the task from the application event loop,
+    // the task exits the application with its exit code.
     QTimer::singleShot(0, task, SLOT(run()));
     return app.exec();
 }
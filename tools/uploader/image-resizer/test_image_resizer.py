@@ -0,0 +1,101 @@
+""" Tests of image_resizer with stub binaries, run by
+`python -m unittest test_image_resizer` from this directory """
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+import image_resizer
+
+# Answers `--batch` like the current image_resizer, images are copied
+BATCH_STUB = """
+import sys, shutil
+def resize(job):
+    try:
+        shutil.copy(job[0], job[1])
+    except (IOError, OSError):
+        return "No such file"
+if sys.argv[1:] == ["--batch"]:
+    sys.stdout.write("image_resizer batch\\n")
+    sys.stdout.flush()
+    for line in iter(sys.stdin.readline, ""):
+        error = resize(line.rstrip("\\n").split("\\t"))
+        sys.stdout.write("error " + error + "\\n" if error else "ok\\n")
+        sys.stdout.flush()
+"""
+
+# Behaves like image_resizer built before `--batch`: wrong arguments and
+# errors are reported to stderr and the exit code is always 0
+LEGACY_STUB = """
+import sys, shutil
+if len(sys.argv) != 5:
+    sys.stderr.write("usage: image_resizer [image_path] [save_path] [new_width] [new_height]\\n")
+    sys.exit(0)
+try:
+    shutil.copy(sys.argv[1], sys.argv[2])
+except (IOError, OSError):
+    sys.stderr.write("No such file\\n")
+"""
+
+
+class ResizerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.image = os.path.join(self.dir, "image.png")
+        with open(self.image, "wb") as fp:
+            fp.write("image")
+        self.missing = os.path.join(self.dir, "missing.png")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def stub(self, name, source):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as fp:
+            fp.write("#!{}\n{}".format(sys.executable, source))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        return path
+
+    def jobs(self, count):
+        return [(self.missing if i % 3 == 0 else self.image,
+                 os.path.join(self.dir, "out{}.png".format(i)), 10, 10)
+                for i in xrange(count)]
+
+    def test_batch(self):
+        resizer = image_resizer.Resizer(self.stub("batch", BATCH_STUB))
+        try:
+            # More replies than a pipe buffer holds
+            jobs = self.jobs(30000)
+            errors = resizer.resize_many(jobs)
+            self.assertTrue(resizer.batch)
+            self.assertEqual(errors, ["No such file" if i % 3 == 0 else None
+                                      for i in xrange(len(jobs))])
+            self.assertEqual(resizer.resize_many(jobs[1:2]), [None])
+        finally:
+            resizer.close()
+
+    def test_legacy_binary(self):
+        resizer = image_resizer.Resizer(self.stub("legacy", LEGACY_STUB))
+        errors = resizer.resize_many(self.jobs(3))
+        self.assertFalse(resizer.batch)
+        self.assertEqual(errors, ["No such file", None, None])
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "out1.png")))
+
+    def test_legacy_binary_cache(self):
+        resizer = image_resizer.Resizer(self.stub("legacy", LEGACY_STUB))
+        cache = image_resizer.ResizeCache(os.path.join(self.dir, "cache"), resizer)
+        path = cache.resize(self.image, 114, 114)
+        self.assertTrue(path.endswith("-114x114.png"))
+        self.assertTrue(os.path.exists(path))
+        self.assertRaises(image_resizer.ResizeError,
+                          cache.resize, self.missing, 114, 114)
+
+    def test_missing_binary(self):
+        resizer = image_resizer.Resizer(os.path.join(self.dir, "nothing"))
+        self.assertRaises(image_resizer.ResizeError,
+                          resizer.resize_many, self.jobs(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,9 @@
 from __future__ import absolute_import
 
-import os
-import json
 import re
 import image_resizer
 from appdf.parsers import AppDF
+from appdf.parsers import reference
 
 
 class Amazon(AppDF):
@@ -16,36 +15,15 @@ class Amazon(AppDF):
         category = super(Amazon, self).category()
         subcategory = super(Amazon, self).subcategory()
         
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        categories_file = os.path.join(current_dir, "..", "..", "..", "spec",
-                                       "store_categories.json")
-        
-        with open(categories_file, "r") as fp:
-            categories = json.load(fp)
-            if subcategory == None:
-                amazon_category = self._replace(categories[type][category][""]["amazon"])
-            else:
-                amazon_category = self._replace(categories[type][category][subcategory]["amazon"])
-                
-            return amazon_category.split("/")[0]
+        amazon_category = self._replace(reference.store_category(type, category, subcategory, "amazon"))
+        return amazon_category.split("/")[0]
 
     def subcategory(self):
         type = super(Amazon, self).type()
         category = super(Amazon, self).category()
         subcategory = super(Amazon, self).subcategory()
         
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        categories_file = os.path.join(current_dir, "..", "..", "..", "spec",
-                                       "store_categories.json")
-        
-        amazon_category = ""
-        with open(categories_file, "r") as fp:
-            categories = json.load(fp)
-            if subcategory == None:
-                amazon_category = self._replace(categories[type][category][""]["amazon"])
-            else:
-                amazon_category = self._replace(categories[type][category][subcategory]["amazon"])
-            
+        amazon_category = self._replace(reference.store_category(type, category, subcategory, "amazon"))
         return amazon_category.split("/")[1] if len(amazon_category.split("/")) == 2 else ""
     
     def _replace(self, category):
@@ -55,17 +33,10 @@ class Amazon(AppDF):
         return category
     
     def language(self):
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        languages_file = os.path.join(current_dir, "..", "..", "..", "spec", "amazon_language.json")
-        with open(languages_file, "r") as fp:
-            return json.load(fp)
+        return reference.amazon_languages()
     
     def currency(self):
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        currency_file = os.path.join(current_dir, "..", "..", "..", "spec",
-                                       "amazon_currency.json")
-        with open(currency_file, "r") as fp:
-            return json.load(fp)
+        return reference.amazon_currencies()
   
     def availability_countries(self):
         return self._availability_countries("amazon_countries.json")
@@ -130,10 +101,7 @@ class Amazon(AppDF):
         }[rating]
 
     def small_app_icon_path(self):
-        app_icon_path = self.app_icon_path()
-        small_icon_path = os.path.join(os.path.dirname(app_icon_path), "small_icon.png")
-        image_resizer.resize(app_icon_path, small_icon_path, 114, 114)
-        return small_icon_path
+        return image_resizer.get_default_cache().resize(self.app_icon_path(), 114, 114)
 
     def binary_alias(self):
         if hasattr(self.obj.application, "store-specific") and hasattr(self.obj.application["store-specific"], "amazon"):
@@ -1,13 +1,27 @@
+from __future__ import absolute_import
+
 import os
+import mmap
+import atexit
+import shutil
+import struct
+import tempfile
+import threading
+import functools
+import hashlib
 import zipfile
+import zlib
 import json
 import lxml.etree
 import lxml.objectify
 import re
 
 import sys
+from appdf.parsers import schema
+from appdf.parsers import reference
 
 def silent_normalize(f):
+    @functools.wraps(f)
     def decorate(self, lang="default"):
         try:
             if lang == "default":
@@ -21,43 +35,197 @@ def silent_normalize(f):
     return decorate
 
 
+def memoize_localized(f):
+    """ Caches accessor result per language until the next ``parse`` call. """
+    @functools.wraps(f)
+    def decorate(self, lang="default"):
+        key = (f.__name__, lang)
+        if key not in self._cache:
+            self._cache[key] = f(self, lang)
+        value = self._cache[key]
+        return list(value) if isinstance(value, list) else value
+
+    return decorate
+
+
+# integrity modes of ``AppDF.parse``
+INTEGRITY_FULL = "full" # check CRC of every member before parsing
+INTEGRITY_LAZY = "lazy" # check CRC of a member when it is read first time
+INTEGRITY_NONE = "none" # do not check CRC explicitly
+INTEGRITY_MODES = (INTEGRITY_FULL, INTEGRITY_LAZY, INTEGRITY_NONE)
+
+# nodes and attributes of description.xml holding names of archive members
+REFERENCED_FILES_XPATH = " | ".join([
+    "//images/app-icon",
+    "//images/large-promo",
+    "//images/small-promo",
+    "//images/screenshots/screenshot",
+    "//videos/video-file",
+    "//apk-files/apk-file",
+    "//rating-certificate/@certificate",
+    "//rating-certificate/@mark",
+])
+
+
+class _VerifiedMember(object):
+    """ File-like object over an archive member which adds its name to
+    `verified` once it is read to the end, zipfile raises on a CRC mismatch
+    before that """
+
+    def __init__(self, fp, info, verified):
+        self._fp = fp
+        self._info = info
+        self._verified = verified
+        self._read = 0
+
+    def read(self, size=-1):
+        return self._count(self._fp.read(size))
+
+    def readline(self, limit=-1):
+        return self._count(self._fp.readline(limit))
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def _count(self, data):
+        self._read += len(data)
+        if self._read >= self._info.file_size:
+            self._verified.add(self._info.filename)
+        return data
+
+    def close(self):
+        self._fp.close()
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 class AppDF(object):
     def __init__(self, file_path):
         self.file_path = file_path
         self.archive = None
+        self._localizations = {}
+        self._cache = {}
+        self._extracted = {}
+        self._tmp_dir = None
+        self._mmap = None
+        self.integrity = INTEGRITY_FULL
+        self.verified = set()
+        # Guards extraction shared with views of the AppDF
+        self._lock = threading.RLock()
+
+    def parse(self, integrity=INTEGRITY_FULL):
+        """ Opens the archive and parses description.xml. `integrity` is one of
+        ``INTEGRITY_MODES``, names of members whose CRC was checked are
+        collected in ``verified`` """
+        if integrity not in INTEGRITY_MODES:
+            raise ValueError("Unknown integrity mode `{}'".format(integrity))
 
-    def parse(self):
         archive = zipfile.ZipFile(self.file_path, "r")
-        if archive.testzip():
-            raise RuntimeError("AppDF file `{}' is broken".format(file))
+        if integrity == INTEGRITY_FULL and archive.testzip():
+            raise RuntimeError("AppDF file `{}' is broken".format(self.file_path))
 
         if "description.xml" not in archive.namelist():
-            raise RuntimeError("Invalid AppDF file `{}'".format(file))
+            raise RuntimeError("Invalid AppDF file `{}'".format(self.file_path))
 
+        self.close()
         self.archive = archive
+        self.integrity = integrity
+        if integrity == INTEGRITY_FULL:
+            self.verified = set(archive.namelist())
+        else:
+            self.verified = set()
+        # zipfile checks CRC of members read completely
         self.xml = archive.read("description.xml")
+        self.verified.add("description.xml")
         self.obj = lxml.objectify.fromstring(self.xml)
+
+        self._cache = {}
+        self._localizations = {}
+        if hasattr(self.obj.application, "description-localization"):
+            for desc in self.obj.application["description-localization"]:
+                self._localizations.setdefault(desc.attrib["language"], desc)
     
+    def view(self, cls):
+        """ Returns instance of AppDF subclass `cls` sharing the parsed archive
+        and extracted files of this AppDF, so one file is parsed once for
+        several stores. The view must not be used after ``close`` """
+        with self._lock:
+            if self._tmp_dir is None:
+                self._tmp_dir = tempfile.mkdtemp(prefix="appdf-")
+                atexit.register(shutil.rmtree, self._tmp_dir, True)
+            view = cls.__new__(cls)
+            view.__dict__.update(self.__dict__)
+            view._cache = {}
+            view._mmap = None
+        return view
+
     def validate(self):
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        xsd_file = os.path.join(current_dir, "..", "..", "..", "spec",
-                                "appdf-description.xsd")
-        schema = lxml.etree.XMLSchema(lxml.etree.parse(xsd_file))
-        schema.assertValid(lxml.etree.fromstring(self.xml))
+        schema.assert_valid(lxml.etree.fromstring(self.xml))
+
+    def close(self):
+        """ Closes the archive and removes files extracted from it """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, True)
+            self._tmp_dir = None
+        self._extracted = {}
+
+    def package(self):
+        return self.obj.application.get("package")
+
+    def languages(self):
+        """ Returns languages of description localizations in document order """
+        if not hasattr(self.obj.application, "description-localization"):
+            return []
+        return [desc.attrib["language"] for desc in self.obj.application["description-localization"]]
+
+    def _texts(self, lang):
+        """ Returns `texts` node for the language or ``None`` """
+        if lang == "default":
+            return self.obj.application.description.texts #required tag
+        desc = self._localizations.get(lang) #optional tags
+        if desc is not None and hasattr(desc, "texts"):
+            return desc.texts
+        return None
+
+    def _text_node(self, lang, tag):
+        texts = self._texts(lang)
+        if texts is not None and hasattr(texts, tag):
+            return texts[tag]
+        return ""
 
+    @memoize_localized
     @silent_normalize
     def title(self, lang="default"):
-        if lang == "default":
-            return self.obj.application.description.texts.title #required tag
-        elif hasattr(self.obj.application, "description-localization"): #optional tags
-            for desc in self.obj.application["description-localization"]:
-                if desc.attrib["language"] == lang:
-                    if hasattr(desc, "texts") and hasattr(desc.texts, "title"):  #optional tags
-                        return desc.texts.title
-                    else:
-                        return ""
-        else:
-            return ""
+        return self._text_node(lang, "title")
             
     def video(self): #optional tags
         if hasattr(self.obj.application.description, "videos") and hasattr(self.obj.application.description.videos, "youtube-video") and self.obj.application.description.videos["youtube-video"]:
@@ -127,64 +295,31 @@ class AppDF(object):
         result = re.sub('<a href="(.*)">.*</a>', r'(\1)', result)
         return result.encode("utf-8")
 
+    @memoize_localized
     def full_description(self, lang="default"):
-        try:
-            if lang == "default": #required tag
-                return self._process_full_description(self.obj.application.description.texts["full-description"])
-            elif hasattr(self.obj.application, "description-localization"): #optional tag
-                for desc in self.obj.application["description-localization"]:
-                    if desc.attrib["language"] == lang:
-                        if hasattr(desc, "texts") and hasattr(desc.texts, "full-description"):
-                            return self._process_full_description(desc.texts["full-description"])
-                        else:
-                            return ""
-        except AttributeError:
-            return ""
+        node = self._text_node(lang, "full-description")
+        if isinstance(node, basestring):
+            return node
+        return self._process_full_description(node)
 
+    @memoize_localized
     @silent_normalize
     def short_description(self, lang="default"):
-        try:
-            if lang == "default": #required tag
-                return self.obj.application.description.texts["short-description"]
-            elif hasattr(self.obj.application, "description-localization"): #optional tag
-                for desc in self.obj.application["description-localization"]:
-                    if desc.attrib["language"] == lang:
-                        if hasattr(desc, "texts") and hasattr(desc.texts, "short-description"):
-                            return desc.texts["short-description"]
-                        else:
-                            return ""
-        except AttributeError:
-            return ""
+        return self._text_node(lang, "short-description")
 
+    @memoize_localized
     def features(self, lang="default"):
         result = []
-        if lang == "default":
-            for feature in self.obj.application.description.texts.features.feature:
+        features = self._text_node(lang, "features")
+        if hasattr(features, "feature"):
+            for feature in features.feature:
                 result.append(feature.text.encode("utf-8"))
-        else:
-            for desc in self.obj.application["description-localization"]:
-                if desc.attrib["language"] == lang:
-                    if hasattr(desc, "texts") and hasattr(desc.texts, "features") and hasattr(desc.texts.features, "feature"):
-                        for feature in desc.texts.features.feature:
-                            result.append(feature.text.encode("utf-8"))
-                    else:
-                        break
         return result
 
+    @memoize_localized
     @silent_normalize
     def recent_changes(self, lang="default"):
-        if lang == "default": #optional tag
-            if hasattr(self.obj.application.description.texts, "recent-changes"):
-                return self.obj.application.description.texts["recent-changes"]
-            else:
-                return ""
-        elif hasattr(self.obj.application, "description-localization"): #optional tag
-            for desc in self.obj.application["description-localization"]:
-                if desc.attrib["language"] == lang:
-                    if hasattr(desc, "texts") and hasattr(desc.texts, "recent-changes"):
-                        return desc.texts["recent-changes"]
-                    else:
-                        return ""
+        return self._text_node(lang, "recent-changes")
 
     @silent_normalize
     def type(self): #required tag
@@ -235,20 +370,16 @@ class AppDF(object):
     def _availability_countries(self, filename):
         result = []
         if hasattr(self.obj.application, "availability") and hasattr(self.obj.application.availability, "countries"):
-            current_dir = os.path.dirname(os.path.realpath(__file__))
-            countries_file = os.path.join(current_dir, "..", "..", "..", "spec", filename)
-            
-            with open(countries_file, "r") as fp:
-                countries_json = json.load(fp)
-                country = self.obj.application.availability.countries
-                if country.attrib["only-listed"] == "yes":
-                    for include in country.include:
-                        if include in countries_json:
-                            result.append(countries_json[include])
-                else:
-                    for exclude in country.exclude:
-                        if exclude in countries_json:
-                            result.append(countries_json[exclude])
+            countries_json = reference.countries(filename)
+            country = self.obj.application.availability.countries
+            if country.attrib["only-listed"] == "yes":
+                for include in country.include:
+                    if include in countries_json:
+                        result.append(countries_json[include])
+            else:
+                for exclude in country.exclude:
+                    if exclude in countries_json:
+                        result.append(countries_json[exclude])
         return result
 
     def period_since(self):
@@ -265,52 +396,130 @@ class AppDF(object):
                 return until.attrib["month"] + "/" + until.attrib["day"] + "/" + until.attrib["year"][2:4]
         return None
         
+    @memoize_localized
     @silent_normalize
     def keywords(self, lang="default"):
-        if lang == "default": #optional tag
-            if hasattr(self.obj.application.description.texts, "keywords"):
-                return self.obj.application.description.texts["keywords"]
+        return self._text_node(lang, "keywords")
+
+    def referenced_files(self):
+        """ Returns names of archive members mentioned in description.xml """
+        result = []
+        for node in self.obj.xpath(REFERENCED_FILES_XPATH):
+            name = self._member_name(node)
+            if name and name not in result:
+                result.append(name)
+        return result
+
+    def missing_files(self):
+        """ Returns names mentioned in description.xml but absent in archive.
+        Only the central directory is used, no member is read """
+        names = set(self.archive.namelist())
+        return [name for name in self.referenced_files() if name not in names]
+
+    def _member_name(self, node):
+        return node.text if hasattr(node, "text") else node
+
+    def open_asset(self, filename):
+        """ Returns file-like object reading the member straight from the
+        archive, its CRC is checked when it is read to the end """
+        info = self.archive.getinfo(self._member_name(filename))
+        fp = self.archive.open(info)
+        if self.integrity == INTEGRITY_LAZY and info.filename not in self.verified:
+            return _VerifiedMember(fp, info, self.verified)
+        return fp
+
+    def asset_buffer(self, filename):
+        """ Returns read-only buffer over the member mapped from the AppDF
+        file without copying or ``None`` if the member is compressed """
+        info = self.archive.getinfo(self._member_name(filename))
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return None
+        if self._mmap is None:
+            with open(self.file_path, "rb") as fp:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._mmap[info.header_offset:info.header_offset + 30]
+        if header[:4] != "PK\003\004":
+            raise RuntimeError("AppDF file `{}' is broken".format(self.file_path))
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        start = info.header_offset + 30 + name_length + extra_length
+        data = buffer(self._mmap, start, info.file_size)
+        if self.integrity == INTEGRITY_LAZY and info.filename not in self.verified:
+            if zlib.crc32(data) & 0xffffffff != info.CRC:
+                raise RuntimeError("AppDF file `{}' is broken".format(self.file_path))
+            self.verified.add(info.filename)
+        return data
+
+    def asset_hash(self, filename):
+        """ Returns SHA-1 hex digest of the member content, it is computed
+        once until the next ``parse`` call """
+        filename = self._member_name(filename)
+        key = ("asset_hash", filename)
+        if key not in self._cache:
+            digest = hashlib.sha1()
+            data = self.asset_buffer(filename)
+            if data is not None:
+                digest.update(data)
             else:
-                return ""
-        elif hasattr(self.obj.application, "description-localization"): #optional tag
-            for desc in self.obj.application["description-localization"]:
-                if desc.attrib["language"] == lang:
-                    if hasattr(desc, "texts") and hasattr(desc.texts, "keywords"):
-                        return desc.texts["keywords"]
-                    else:
-                        return ""
+                with self.open_asset(filename) as fp:
+                    for chunk in iter(lambda: fp.read(1 << 16), ""):
+                        digest.update(chunk)
+            self._cache[key] = digest.hexdigest()
+        return self._cache[key]
 
     def _get_path_and_extract(self, filename):
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        tmp_dir = os.path.join(current_dir, "..", "..", "..", "tmp")
-        self.archive.extract(filename, tmp_dir)
-        return os.path.join(tmp_dir, str(filename))
-
-    def apk_paths(self):
+        """ Extracts the member into a temporary directory of this AppDF once
+        and returns its path in filesystem """
+        filename = self._member_name(filename)
+        with self._lock:
+            if filename not in self._extracted:
+                if self._tmp_dir is None:
+                    self._tmp_dir = tempfile.mkdtemp(prefix="appdf-")
+                    atexit.register(shutil.rmtree, self._tmp_dir, True)
+                self._extracted[filename] = self.archive.extract(filename, self._tmp_dir)
+                # zipfile checks CRC of extracted members
+                self.verified.add(filename)
+            return self._extracted[filename]
+
+    def apk_files(self):
         result = []
         apk_files = self.obj.application["apk-files"]
         for apk_file in apk_files["apk-file"]:
-            result.append(self._get_path_and_extract(apk_file))
+            result.append(apk_file.text)
         return result
 
+    def apk_paths(self):
+        return [self._get_path_and_extract(apk_file) for apk_file in self.apk_files()]
+
+    def app_icon_file(self):
+        return self.obj.application.description.images["app-icon"].text
+
     def app_icon_path(self):
-        app_icon_file = self.obj.application.description.images["app-icon"]
-        return self._get_path_and_extract(app_icon_file)
+        return self._get_path_and_extract(self.app_icon_file())
 
-    def large_promo_path(self):
+    def large_promo_file(self):
         if not hasattr(self.obj.application.description.images, "large-promo"):
             return None
-        large_promo_file = self.obj.application.description.images["large-promo"]
+        return self.obj.application.description.images["large-promo"].text
+
+    def large_promo_path(self):
+        large_promo_file = self.large_promo_file()
+        if large_promo_file is None:
+            return None
         return self._get_path_and_extract(large_promo_file)
 
-    def small_promo_path(self):
+    def small_promo_file(self):
         if not hasattr(self.obj.application.description.images, "small-promo"):
             return None
-        small_promo_file = self.obj.application.description.images["small-promo"]
+        return self.obj.application.description.images["small-promo"].text
+
+    def small_promo_path(self):
+        small_promo_file = self.small_promo_file()
+        if small_promo_file is None:
+            return None
         return self._get_path_and_extract(small_promo_file)
 
-    def screenshot_paths(self):
-        """ Return paths to screenshots in filesystem with best resolution """
+    def screenshot_files(self):
+        """ Return names of screenshots in archive with best resolution """
         indexes = dict()
         screenshots = self.obj.application.description.images.screenshots
         for screenshot in screenshots.screenshot:
@@ -319,9 +528,13 @@ class AppDF(object):
                 indexes[index] = screenshot
         result = []
         for key, value in sorted(indexes.items()):
-            result.append(self._get_path_and_extract(value))
+            result.append(value.text)
         return result
 
+    def screenshot_paths(self):
+        """ Return paths to screenshots in filesystem with best resolution """
+        return [self._get_path_and_extract(screenshot) for screenshot in self.screenshot_files()]
+
     def us_export_laws(self):
         return hasattr(self.obj.application.consent, "us-export-laws") and self.obj.application.consent["us-export-laws"] == "yes"
 
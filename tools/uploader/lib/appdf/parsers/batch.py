@@ -0,0 +1,78 @@
+from __future__ import absolute_import
+
+import os
+import Queue
+import multiprocessing
+from appdf.parsers import schema
+from appdf.parsers.appdf import AppDF
+
+APPDF_EXTENSIONS = (".appdf", ".zip")
+DEFAULT_QUEUE_SIZE = 32
+
+
+def find_appdf_files(root):
+    """ Walks the directory tree and yields paths of AppDF files in sorted
+    order. """
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(APPDF_EXTENSIONS):
+                yield os.path.join(dir_path, file_name)
+
+
+def validate_file(file_path):
+    """ Opens, validates and parses a single AppDF file. Never raises, returns
+    a record with `file`, `valid`, `error`, `package` and `title` keys. """
+    record = {
+        "file": file_path,
+        "valid": False,
+        "error": None,
+        "package": None,
+        "title": None,
+    }
+    app = AppDF(file_path)
+    try:
+        app.parse()
+        app.validate()
+        record["package"] = app.obj.application.attrib.get("package")
+        record["title"] = app.title()
+        app.type()
+        app.category()
+        missing = app.missing_files()
+        if missing:
+            raise RuntimeError("Files mentioned in description.xml are missing: {}".format(
+                ", ".join(missing)))
+        record["valid"] = True
+    except Exception as e:
+        record["error"] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        app.close()
+    return record
+
+
+def validate_files(file_paths, processes=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """ Validates AppDF files in a pool of worker processes and yields records
+    (see ``validate_file``) in order of completion. No more than `queue_size`
+    files are scheduled at once. """
+    pool = multiprocessing.Pool(processes, initializer=schema.get_schema)
+    results = Queue.Queue()
+    pending = 0
+    try:
+        for file_path in file_paths:
+            if pending >= queue_size:
+                yield results.get()
+                pending -= 1
+            pool.apply_async(validate_file, (file_path,), callback=results.put)
+            pending += 1
+        while pending:
+            yield results.get()
+            pending -= 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def validate_directory(root, processes=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """ Validates every AppDF file found in the directory tree. """
+    return validate_files(find_appdf_files(root), processes, queue_size)
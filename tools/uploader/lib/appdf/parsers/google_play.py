@@ -1,8 +1,7 @@
 from __future__ import absolute_import
 
-import os
-import json
 from appdf.parsers import AppDF
+from appdf.parsers import reference
 
 
 class GooglePlay(AppDF):
@@ -17,14 +16,7 @@ class GooglePlay(AppDF):
 
         type = super(GooglePlay, self).type()
 
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        categories_file = os.path.join(current_dir, "..", "..", "..", "spec",
-                                       "store_categories.json")
-
-        with open(categories_file, "r") as fp:
-            categories = json.load(fp)
-            google_category = categories[type][category][subcategory]["google"]
-            return google_category
+        return reference.store_category(type, category, subcategory, "google")
 
     def rating(self):
         rating = super(GooglePlay, self).rating()
@@ -44,12 +36,9 @@ class GooglePlay(AppDF):
     def local_prices(self):
         prices = super(GooglePlay, self).local_prices()
 
-        current_dir = os.path.dirname(os.path.realpath(__file__))
-        countries_file = os.path.join(current_dir, "..", "..", "..", "spec", "google_countries.json")
-        with open(countries_file, "r") as fp:
-            countries_json = json.load(fp)
-            for price in prices:
-                price[0] = countries_json[price[0]]
+        countries = reference.countries("google_countries.json")
+        for price in prices:
+            price[0] = countries[price[0]]
         return prices
 
     def google_android_content_guidelines(self):
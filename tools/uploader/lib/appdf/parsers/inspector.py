@@ -0,0 +1,39 @@
+from __future__ import absolute_import
+
+from appdf.parsers import schema
+from appdf.parsers.appdf import AppDF, INTEGRITY_NONE
+
+
+def inspect(file_path, validate=False):
+    """ Quick pre-check of an AppDF file that reads only the zip central
+    directory and description.xml. Checks that every file mentioned in
+    description.xml is present in the archive without opening it and, if
+    `validate` is set, validates description.xml against XML schema.
+    Never raises, returns a record with `file`, `valid`, `error`, `package`,
+    `title` and `missing` keys. """
+    record = {
+        "file": file_path,
+        "valid": False,
+        "error": None,
+        "package": None,
+        "title": None,
+        "missing": [],
+    }
+    app = AppDF(file_path)
+    try:
+        app.parse(INTEGRITY_NONE)
+        if validate:
+            app.validate()
+        record["package"] = app.obj.application.attrib.get("package")
+        record["title"] = app.title()
+        record["missing"] = app.missing_files()
+        if record["missing"]:
+            record["error"] = "Files mentioned in description.xml are missing: {}".format(
+                ", ".join(record["missing"]))
+        else:
+            record["valid"] = True
+    except Exception as e:
+        record["error"] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        app.close()
+    return record
@@ -0,0 +1,79 @@
+import os
+import json
+import threading
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+SPEC_DIR = os.path.join(current_dir, "..", "..", "..", "spec")
+
+
+class FrozenDict(dict):
+    """ Read-only dict shared between all users of the reference data. """
+
+    def _readonly(self, *args, **kw):
+        raise TypeError("Reference data is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+_cache = {}
+_lock = threading.RLock()
+
+
+def _cached(key, build):
+    with _lock:
+        if key not in _cache:
+            _cache[key] = build()
+        return _cache[key]
+
+
+def _load_json(filename):
+    with open(os.path.join(SPEC_DIR, filename), "r") as fp:
+        return json.load(fp)
+
+
+def countries(filename="countries.json"):
+    """ Returns mapping of country code to country name used by a store
+    (`filename` is one of *countries.json files in spec directory). """
+    return _cached(filename, lambda: FrozenDict(_load_json(filename)))
+
+
+def country_codes(filename="countries.json"):
+    """ Returns frozenset of country codes known to a store. """
+    return _cached((filename, "codes"), lambda: frozenset(countries(filename)))
+
+
+def country_name(code, filename="countries.json"):
+    """ Returns store name of the country or ``None`` if it is unknown. """
+    return countries(filename).get(code)
+
+
+def store_categories():
+    """ Returns mapping of (type, category, subcategory) to a mapping of store
+    to its category name. """
+    def build():
+        result = {}
+        for type, categories in _load_json("store_categories.json").iteritems():
+            for category, subcategories in categories.iteritems():
+                for subcategory, stores in subcategories.iteritems():
+                    result[(type, category, subcategory)] = FrozenDict(stores)
+        return FrozenDict(result)
+    return _cached("store_categories.json", build)
+
+
+def store_category(type, category, subcategory, store):
+    """ Returns category name in the given store. Raises ``KeyError`` for
+    unknown category. """
+    return store_categories()[(type, category, subcategory or "")][store]
+
+
+def amazon_languages():
+    """ Returns mapping of AppDF language code to Amazon language name. """
+    return _cached("amazon_language.json",
+                   lambda: FrozenDict(_load_json("amazon_language.json")))
+
+
+def amazon_currencies():
+    """ Returns mapping of country code to Amazon currency code. """
+    return _cached("amazon_currency.json",
+                   lambda: FrozenDict(_load_json("amazon_currency.json")))
@@ -0,0 +1,67 @@
+import os
+import threading
+import lxml.etree
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_SCHEMA_PATH = os.path.join(current_dir, "..", "..", "..", "spec",
+                                   "appdf-description.xsd")
+
+
+class SchemaRegistry(object):
+    """ Compiles every XSD file once per process and shares it between
+    threads. Entries are keyed by the real path of the file and recompiled
+    when its modification time changes. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schemas = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, xsd_path=DEFAULT_SCHEMA_PATH):
+        """ Returns compiled ``lxml.etree.XMLSchema`` for the given file. """
+        return self._entry(xsd_path)[1]
+
+    def assert_valid(self, document, xsd_path=DEFAULT_SCHEMA_PATH):
+        """ Validates the document (an ``lxml`` tree or element) and raises
+        ``lxml.etree.DocumentInvalid`` if it does not match the schema. """
+        mtime, schema, lock = self._entry(xsd_path)
+        # error log of a schema is not shared safely between validations
+        with lock:
+            schema.assertValid(document)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "schemas": len(self._schemas)}
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _entry(self, xsd_path):
+        path = os.path.realpath(xsd_path)
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            entry = self._schemas.get(path)
+            if entry and entry[0] == mtime:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            schema = lxml.etree.XMLSchema(lxml.etree.parse(path))
+            entry = (mtime, schema, threading.Lock())
+            self._schemas[path] = entry
+            return entry
+
+
+registry = SchemaRegistry()
+
+
+def get_schema(xsd_path=DEFAULT_SCHEMA_PATH):
+    return registry.get(xsd_path)
+
+
+def assert_valid(document, xsd_path=DEFAULT_SCHEMA_PATH):
+    registry.assert_valid(document, xsd_path)
@@ -3,3 +3,7 @@ from __future__ import absolute_import
 from appdf.publishers.amazon import Amazon
 from appdf.publishers.google_play import GooglePlay
 from appdf.publishers.appdf_sender import AppdfSender
+from appdf.publishers.session_pool import SessionPool
+from appdf.publishers.journal import Journal
+from appdf.publishers.manifest import Diff
+from appdf.publishers.debug_capture import DebugCapture
@@ -3,58 +3,75 @@
 import os
 import re
 import sys
-import time
 import json
 import webkit_server
+from appdf.publishers import uploads
+from appdf.publishers.debug_capture import DebugCapture, flushed_on_failure
+from appdf.publishers.country_table import CountryTable, print_report
 
+IMAGE_LOAD_ATTEMPTS = 5
 
-def fill_element(element, value):
-    if value:
-        # Funny trick for multiline string
-        element.eval_script("""
-            var valueString = function(){{/*{}*/}}.toString().slice(15,-4);
-            node.value = valueString;
-            var event = document.createEvent("HTMLEvents");
-            event.initEvent("change", true, true);
-            node.dispatchEvent(event);
-        """.format(value))
+AVAILABILITY_FIELDS = ["availability_type", "availability_countries", "paid",
+                       "base_price", "local_prices", "period_since",
+                       "free_app_of_day"]
+DESCRIPTION_FIELDS = ["short_description", "full_description", "features", "keywords"]
+CONTENT_RATING_FIELDS = ["content_desc", "include_content"]
 
-def fill(elements, values):
-    for i, value in enumerate(values):
-        if value:
-            fill_element(elements[i], value)
+
+def fill(session, fields):
+    """ Sets values of ``(xpath, value)`` pairs in a single script, fields
+    with empty values are skipped. Waits for the first field to appear. """
+    fields = [(xpath, value) for xpath, value in fields if value]
+    if not fields:
+        return
+    session.at_xpath(fields[0][0])
+    for (xpath, value), found in zip(fields, session.fill_many(fields)):
+        if not found:
+            print "Field not found:", xpath
 
 
 class Amazon(object):
-    def __init__(self, app, username, password, debug_dir=None):
+    def __init__(self, app, username, password, debug_dir=None, session=None,
+                 upload_concurrency=uploads.DEFAULT_CONCURRENCY, journal=None,
+                 diff=None, capture=None):
         self.app = app
         self.username = username
         self.password = password
         self.debug_dir = debug_dir
+        self.upload_concurrency = upload_concurrency
+        # Steps completed by previous runs are skipped
+        self.journal = journal
+        # Only fields and assets changed since the last publish are filled
+        self.diff = diff
+        # Debug snapshots of pages, taken if debug directory is set
+        self.capture = capture
+        if self.capture is None and self.debug_dir:
+            self.capture = DebugCapture(self.debug_dir)
 
-        self.session = webkit_server.Client()
-
-        if self.debug_dir:
-            if not os.path.exists(self.debug_dir):
-                os.mkdir(self.debug_dir)
+        self.session = session or webkit_server.Client()
 
     def publish(self):
-        self.open_console()
-        self.login()
-        if self.session.at_css("#ap_signin_existing_radio"):
-            print "Login error"
-            sys.exit(1)
-        
-        if self.ensure_application_listed():
-            self.open_application()
-        else:
-            self.create_application()
-        self.fill_general_information()
-        self.fill_availability()
-        self.fill_description()
-        self.fill_content_rating()
-        self.fill_images_multimedia()
-        self.fill_binary_files()
+        with flushed_on_failure(self.capture):
+            self.open_console()
+            self.login()
+            if self.session.at_css("#ap_signin_existing_radio"):
+                print "Login error"
+                sys.exit(1)
+
+            if self.ensure_application_listed():
+                self.open_application()
+            else:
+                self.create_application()
+            self._step("general_information", self.fill_general_information)
+            self._step("availability", self.fill_availability)
+            self._step("description", self.fill_description)
+            self._step("content_rating", self.fill_content_rating)
+            self._step("images_multimedia", self.fill_images_multimedia)
+            self._step("binary_files", self.fill_binary_files)
+            if self.journal:
+                self.journal.clear()
+            if self.diff:
+                self.diff.save()
             
     
     # Actions
@@ -64,7 +81,11 @@ class Amazon(object):
 
     def login(self):
         xpath = "//a[@id=\"header_login_link\"]"
-        self.session.at_xpath(xpath).click()
+        login_link = self.session.at_xpath(xpath)
+        if not login_link:
+            # Session is already logged in
+            return
+        login_link.click()
         
         email_field = self.session.at_css("#ap_email")
         # radio_button
@@ -100,30 +121,30 @@ class Amazon(object):
         if self.session.at_xpath("//input[@id=\"same\" and @checked]"):
             self.session.at_xpath("//input[@id=\"same\" and @checked]").click()
         
-        fill([
-            self.session.at_xpath("//input[@id=\"title\"]"),
-            self.session.at_xpath("//input[@id=\"email\"]"),
-            self.session.at_xpath("//input[@id=\"phone\"]"),
-            self.session.at_xpath("//input[@id=\"website\"]"),
-            self.session.at_xpath("//input[@id=\"privacyPolicyUrl\"]")
-        ], [
-            self.app.title("default"),
-            self.app.email(),
-            self.app.phone(),
-            self.app.website(),
-            self.app.privacy_policy_link()
+        fill(self.session, [
+            ("//input[@id=\"title\"]", self._value("title", "default")),
+            ("//input[@id=\"email\"]", self._value("email")),
+            ("//input[@id=\"phone\"]", self._value("phone")),
+            ("//input[@id=\"website\"]", self._value("website")),
+            ("//input[@id=\"privacyPolicyUrl\"]", self._value("privacy_policy_link"))
         ])
         
+        if self._fields_changed(["category", "subcategory"]):
+            self.fill_category()
+            
+        xpath = "//input[@id=\"submit_button\"]"
+        self.session.at_xpath(xpath).click();
+        self._debug("general_info", "saved")
+        self.error_check()
+        
+    def fill_category(self):
         # Category selection
         xpath = "//select[@id=\"parentCategoryList\"]/option[contains(text(), \"{}\")]"
         xpath = xpath.format(self.app.category())
         category_value = self.session.at_xpath(xpath).value()
-        fill([
-            self.session.at_xpath("//select[@id=\"parentCategoryList\"]"),
-            self.session.at_xpath("//input[@id=\"selectedCategory\"]")
-        ], [
-            category_value,
-            category_value
+        fill(self.session, [
+            ("//select[@id=\"parentCategoryList\"]", category_value),
+            ("//input[@id=\"selectedCategory\"]", category_value)
         ])
         
         # Subcategory selection
@@ -133,20 +154,16 @@ class Amazon(object):
             xpath = xpath.format(self.app.subcategory())
             subcategory_value = self.session.at_xpath(xpath).get_attr("value")
             if self.session.at_xpath(xpath):
-                fill([
-                    self.session.at_xpath("//select[@id=\"childCategoryList\"]"),
-                    self.session.at_xpath("//input[@id=\"selectedCategory\"]")
-                ], [
-                    subcategory_value,
-                    subcategory_value
+                fill(self.session, [
+                    ("//select[@id=\"childCategoryList\"]", subcategory_value),
+                    ("//input[@id=\"selectedCategory\"]", subcategory_value)
                 ])
-            
-        xpath = "//input[@id=\"submit_button\"]"
-        self.session.at_xpath(xpath).click();
-        self._debug("general_info", "saved")
-        self.error_check()
         
     def fill_availability(self):
+        if not self._fields_changed(AVAILABILITY_FIELDS):
+            print "Availability and pricing are unchanged, skip"
+            return
+            
         xpath = "//a[@id=\"header_nav_availability_pricing_a\"]"
         if self.session.at_xpath(xpath):
             self._ensure(xpath).click();
@@ -167,10 +184,7 @@ class Amazon(object):
                     self.session.at_xpath("//div[@id=\"" + selection + "\"]/label[1]/input").click()
                 
             # Only listed
-            for country in self.app.availability_countries():
-                country = country.encode("utf-8")
-                if self.session.at_xpath("//input[@id=\"" + country + "\"]"):
-                    self.session.at_xpath("//input[@id=\"" + country + "\"]").click()
+            print_report(self._country_table().apply(self.app.availability_countries(), True))
             
         elif self.app.availability_type() == "exclude":
             self.session.at_xpath("//input[@id=\"availableWorldWide2\"]").click()
@@ -183,10 +197,7 @@ class Amazon(object):
                     self.session.at_xpath("//div[@id=\"" + selection + "\"]/label[1]/input").click()
             
             # All except
-            for country in self.app.availability_countries():
-                country = country.encode("utf-8")
-                if self.session.at_xpath("//input[@id=\"" + country + "\"]"):
-                    self.session.at_xpath("//input[@id=\"" + country + "\"]").click()
+            print_report(self._country_table().apply(self.app.availability_countries(), False))
             
         else:
             self.session.at_xpath("//input[@id=\"availableWorldWide1\"]").click()
@@ -194,41 +205,25 @@ class Amazon(object):
         # Prices
         if self.app.paid():
             self.session.at_xpath("//input[@id=\"charging-yes\"]").click()
-            fill([
-                self.session.at_xpath("//select[@id=\"base_currency\"]"),
-                self.session.at_xpath("//input[@id=\"price\"]")
-            ],[
-                "USD", #base currency
-                self.app.base_price()
+            fill(self.session, [
+                ("//select[@id=\"base_currency\"]", "USD"), #base currency
+                ("//input[@id=\"price\"]", self.app.base_price())
             ])
             
             self.session.at_xpath("//input[@id=\"pricing_custom\"]").click()
             
             currency = self.app.currency()
-            for local_price in self.app.local_prices():
-                country = local_price[0]
-                price = local_price[1]
-                if country in currency:
-                    fill_element(
-                        self.session.at_xpath("//input[@id=\"" + currency[country] + "_" + country + "\"]"),
-                        price
-                    )
+            fill(self.session, [
+                ("//input[@id=\"" + currency[country] + "_" + country + "\"]", price)
+                for country, price in self.app.local_prices() if country in currency
+            ])
         else:
             self.session.at_xpath("//input[@id=\"charging-no-free-app\"]").click()
         
-        # Period
-        if self.app.period_since() != None:
-            fill([
-                self.session.at_xpath("//input[@id=\"availabilityDate\"]")
-            ],[
-                self.app.period_since()
-            ])
-        
-        # Free app of day
-        fill([
-            self.session.at_xpath("//input[@id=\"fad\"]")
-        ], [
-            self.app.free_app_of_day()
+        # Period and free app of day
+        fill(self.session, [
+            ("//input[@id=\"availabilityDate\"]", self.app.period_since()),
+            ("//input[@id=\"fad\"]", self.app.free_app_of_day())
         ])
         
         xpath = "//input[@id=\"submit_button\"]"
@@ -241,22 +236,23 @@ class Amazon(object):
         if self.session.at_xpath(xpath):
             self._ensure(xpath).click();
         
-        self.form_description("default")
-        
-        if hasattr(self.app.obj.application, "description-localization"):
-            language_json = self.app.language()
-            for desc in self.app.obj.application["description-localization"]:
-                language = desc.attrib["language"]
-                if language in language_json:
-                    xpath = "//ul[@id=\"collectable_nav_list\"]/li/a[contains(text(), \"{}\")]"
-                    xpath = xpath.format(language_json[language])
-                    if self.session.at_xpath(xpath):
-                        self.session.at_xpath(xpath).click()
-                        self.form_description(language)
-                    else:
-                        xpath = "//ul[@id=\"collectable_nav_list\"]/li[last()]/a"
-                        self.session.at_xpath(xpath).click()
-                        self.form_description(language, language_json[language])
+        if self._fields_changed(DESCRIPTION_FIELDS, "default"):
+            self.form_description("default")
+        
+        language_json = self.app.language()
+        for language in self.app.languages():
+            if language in language_json:
+                xpath = "//ul[@id=\"collectable_nav_list\"]/li/a[contains(text(), \"{}\")]"
+                xpath = xpath.format(language_json[language])
+                if self.session.at_xpath(xpath):
+                    if not self._fields_changed(DESCRIPTION_FIELDS, language):
+                        continue
+                    self.session.at_xpath(xpath).click()
+                    self.form_description(language)
+                else:
+                    xpath = "//ul[@id=\"collectable_nav_list\"]/li[last()]/a"
+                    self.session.at_xpath(xpath).click()
+                    self.form_description(language, language_json[language])
         
     def form_description(self, lang="default", locale_label=""):
         xpath = "//a[@id=\"edit_button\"]"
@@ -265,22 +261,20 @@ class Amazon(object):
         elif locale_label != "":
             xpath = "//select[@id=\"locale\"]/option[contains(text(), \"{}\")]"
             xpath = xpath.format(locale_label)
-            fill([
-                self.session.at_xpath("//select[@id=\"locale\"]")
-            ], [
-                self.session.at_xpath(xpath).value()
+            fill(self.session, [
+                ("//select[@id=\"locale\"]", self.session.at_xpath(xpath).value())
             ])
         
-        fill([
-            self.session.at_xpath("//textarea[@id=\"dpShortDescription\"]"),
-            self.session.at_xpath("//textarea[@id=\"publisherDescription\"]"),
-            self.session.at_xpath("//textarea[@id=\"dpMarketingBulletsStr\"]"),
-            self.session.at_xpath("//textarea[@id=\"keywordsString\"]")
-        ], [
-            self.app.short_description(lang),
-            self.app.full_description(lang),
-            '\n'.join(self.app.features(lang)),
-            self.app.keywords(lang)
+        # A new locale is filled entirely
+        force = locale_label != ""
+        fill(self.session, [
+            ("//textarea[@id=\"dpShortDescription\"]",
+             self._value("short_description", lang, force)),
+            ("//textarea[@id=\"publisherDescription\"]",
+             self._value("full_description", lang, force)),
+            ("//textarea[@id=\"dpMarketingBulletsStr\"]",
+             '\n'.join(self._value("features", lang, force) or [])),
+            ("//textarea[@id=\"keywordsString\"]", self._value("keywords", lang, force))
         ])
         self._debug("description", "fill_"+lang)
         
@@ -299,33 +293,43 @@ class Amazon(object):
             self._ensure(xpath).click();
         self._debug("images_multimedia", "opened")
 
-        # Small application icon
-        small_icon_path = self.app.small_app_icon_path()
-        xpath = "//*[@id='itemsection_multimedia']/div/fieldset/table/tbody/tr[1]/td[2]/div"
-        self.delete_file(self.session.at_xpath(xpath))
-        self.upload_file(self.session.at_xpath(xpath + "/div[@class='asset']"), small_icon_path)
+        scheduler = uploads.UploadScheduler(self.session,
+                                            self.upload_concurrency,
+                                            IMAGE_LOAD_ATTEMPTS)
+
+        # Both icons are made of the application icon
+        if self._asset_changed("app_icon", self.app.app_icon_file()):
+            # Small application icon
+            small_icon_path = self.app.small_app_icon_path()
+            xpath = "//*[@id='itemsection_multimedia']/div/fieldset/table/tbody/tr[1]/td[2]/div"
+            self.delete_file(self.session.at_xpath(xpath))
+            self._add_file_upload(scheduler, xpath + "/div[@class='asset']", small_icon_path)
 
-        # Application icon
-        app_icon_path = self.app.app_icon_path()
-        xpath = "//*[@id='itemsection_multimedia']/div/fieldset/table/tbody/tr[2]/td[2]/div"
-        self.delete_file(self.session.at_xpath(xpath))
-        self.upload_file(self.session.at_xpath(xpath + "/div[@class='asset']"), app_icon_path)
+            # Application icon
+            app_icon_path = self.app.app_icon_path()
+            xpath = "//*[@id='itemsection_multimedia']/div/fieldset/table/tbody/tr[2]/td[2]/div"
+            self.delete_file(self.session.at_xpath(xpath))
+            self._add_file_upload(scheduler, xpath + "/div[@class='asset']", app_icon_path)
 
-        # Delete old screenshot
-        xpath = "//*[@id='itemsection_multimedia']/div/fieldset/table/tbody/tr[3]/td[2]"
-        while self.delete_file(self.session.at_xpath(xpath)):
-            pass
+        if self._asset_changed("screenshots", self.app.screenshot_files()):
+            # Delete old screenshot
+            xpath = "//*[@id='itemsection_multimedia']/div/fieldset/table/tbody/tr[3]/td[2]"
+            while self.delete_file(self.session.at_xpath(xpath)):
+                pass
 
-        self._debug("old_screenshots", "deleted")
-        screenshots = self.app.screenshot_paths()
-        for screenshot in screenshots:
-            self.upload_file(self.session.at_xpath(xpath + "/div[@class='asset']"), screenshot)
+            self._debug("old_screenshots", "deleted")
+            screenshots = self.app.screenshot_paths()
+            for screenshot in screenshots:
+                self._add_file_upload(scheduler, xpath + "/div[@class='asset']", screenshot)
 
         large_promo_path = self.app.large_promo_path()
-        if large_promo_path:
+        if large_promo_path and \
+                self._asset_changed("large_promo", self.app.large_promo_file()):
             xpath = "//*[@id='itemsection_multimedia']/div/fieldset/table/tbody/tr[4]/td[2]/div"
             self.delete_file(self.session.at_xpath(xpath))
-            self.upload_file(self.session.at_xpath(xpath + "/div[@class='asset']"), large_promo_path)
+            self._add_file_upload(scheduler, xpath + "/div[@class='asset']", large_promo_path)
+
+        scheduler.run_or_raise()
 
         xpath = "//input[@id=\"submit_button\"]"
         self.session.at_xpath(xpath).click();
@@ -333,6 +337,10 @@ class Amazon(object):
         self.error_check()
         
     def fill_content_rating(self):
+        if not self._fields_changed(CONTENT_RATING_FIELDS):
+            print "Content rating is unchanged, skip"
+            return
+            
         xpath = "//a[@id=\"header_nav_rating_a\"]"
         if self.session.at_xpath(xpath):
             self._ensure(xpath).click();
@@ -358,15 +366,13 @@ class Amazon(object):
         xpath = "//input[@id=\"maturityratingcategory.sexual_and_suggestive_content_" + content_desc[6] + "\"]"
         self.session.at_xpath(xpath).click()
         
-        fill([
-            self.session.at_xpath("//input[@id=\"maturityratingcategory.account_creation\"]"),
-            self.session.at_xpath("//input[@id=\"maturityratingcategory.advertisements\"]"),
-            self.session.at_xpath("//input[@id=\"maturityratingcategory.gambling\"]"),
-            self.session.at_xpath("//input[@id=\"maturityratingcategory.location_detection\"]"),
-            self.session.at_xpath("//input[@id=\"maturityratingcategory.user_generated_content_or_user_to_user_communication\"]")
-        ], 
-            self.app.include_content()
-        )
+        fill(self.session, zip([
+            "//input[@id=\"maturityratingcategory.account_creation\"]",
+            "//input[@id=\"maturityratingcategory.advertisements\"]",
+            "//input[@id=\"maturityratingcategory.gambling\"]",
+            "//input[@id=\"maturityratingcategory.location_detection\"]",
+            "//input[@id=\"maturityratingcategory.user_generated_content_or_user_to_user_communication\"]"
+        ], self.app.include_content()))
         
         xpath = "//input[@id=\"submit_button\"]"
         self.session.at_xpath(xpath).click();
@@ -384,10 +390,11 @@ class Amazon(object):
         self._debug("binary_files", "opened")
         
         # Upload APK
-        apk_path = self.app.apk_paths()[0]
-        xpath = "//*[@id='itemsection_binary']/div/fieldset/table/tbody/tr[4]/td[2]/div"
-        self.delete_file(self.session.at_xpath(xpath))
-        self.upload_file(self.session.at_xpath(xpath + "/div[@class='asset']"), apk_path)
+        if self._asset_changed("apk", self.app.apk_files()):
+            apk_path = self.app.apk_paths()[0]
+            xpath = "//*[@id='itemsection_binary']/div/fieldset/table/tbody/tr[4]/td[2]/div"
+            self.delete_file(self.session.at_xpath(xpath))
+            self.upload_file(self.session.at_xpath(xpath + "/div[@class='asset']"), apk_path)
 
         # Apply Amazon DRM
         if self.app.apply_amazon_drm():
@@ -441,7 +448,35 @@ class Amazon(object):
     def upload_file(self, file_div, file_path):
         file_div.set_attr("class", "")
         file_div.at_xpath("div/input").set(file_path)
-        print "Uploaded:", os.path.basename(file_path)
+        print "Upload started:", os.path.basename(file_path)
+
+    def file_upload_state(self, asset_div):
+        """ ``None`` while the file is uploading, ``True`` if it is uploaded
+        and ``False`` on error. Lookups do not wait, since neither element
+        exists while the upload is in progress """
+        # Error classes of the form, see error_check
+        if asset_div.xpath(".//*[@class='error' or @class='error-row']"):
+            return False
+        # The remove link of an uploaded file, see delete_file
+        if asset_div.xpath("div/a[contains(@class, 'remove')]"):
+            return True
+        return None
+
+    def _add_file_upload(self, scheduler, xpath, file_path):
+        """ Adds an upload to the first asset div matching `xpath` when the
+        upload starts, retries reuse the same div """
+        slot = {}
+        def start():
+            if "div" not in slot:
+                slot["div"] = self.session.at_xpath(xpath)
+            self.upload_file(slot["div"], file_path)
+        return scheduler.add(file_path, start,
+                             lambda: self.file_upload_state(slot["div"]))
+
+    def _country_table(self):
+        """ Country checkboxes keyed by country codes """
+        return CountryTable(self.session, "//input[@type='checkbox'][@id]", key_attr="id",
+                            checkbox=".", exact=True)
 
     # Checks
     def ensure_application_listed(self):
@@ -460,10 +495,32 @@ class Amazon(object):
             sys.exit(1)
     
     # Helpers
+    def _fields_changed(self, names, lang=None):
+        return self.diff is None or self.diff.fields_changed(self.app, names, lang)
+
+    def _asset_changed(self, key, filenames):
+        return self.diff is None or self.diff.asset_changed(key, self.app, filenames)
+
+    def _value(self, name, lang=None, force=False):
+        """ Returns value of AppDF field or ``None`` if the field is unchanged
+        since the last publish """
+        if lang is None:
+            value = getattr(self.app, name)()
+        else:
+            value = getattr(self.app, name)(lang)
+        if self._fields_changed([name], lang) or force:
+            return value
+        return None
+
+    def _step(self, name, action):
+        if self.journal:
+            self.journal.run(name, action)
+        else:
+            action()
+
     def _debug(self, action, state):
         print action + " : " + state
         
-        if self.debug_dir:
-            file_name = "{}-{}-{}.png".format(time.time(), action, state)
-            self.session.render(os.path.join(self.debug_dir, file_name))
+        if self.capture:
+            self.capture.take(self.session, action, state)
         
@@ -1,11 +1,38 @@
 import os
 import sys
+import time
 import requests
 import json
+from appdf.publishers.multipart import MultipartEncoder, DEFAULT_CHUNK_SIZE
+
+UPLOAD_ATTEMPTS = 3
+RETRY_DELAY = 5
+CONNECTION_POOL_SIZE = 10
+
+
+def create_session():
+    """ Returns requests session keeping connections to stores alive """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE,
+                                            pool_maxsize=CONNECTION_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def print_progress(sent, total):
+    percent = sent * 100 / total if total else 100
+    if percent != print_progress.percent or sent == total:
+        print "\rUpload AppDF: {}%".format(percent),
+        sys.stdout.flush()
+    print_progress.percent = percent
+print_progress.percent = None
 
 
 class AppdfSender(object):
-    def __init__(self, username, password, url, command, package, file):
+    def __init__(self, username, password, url, command, package, file,
+                 session=None, progress=print_progress,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
         self.username = username
         self.password = password
         
@@ -15,6 +42,12 @@ class AppdfSender(object):
         
         self.url = url+"/appdf?command=%s" % self.command
         
+        # Connections are kept alive between requests of the session
+        self.session = session or create_session()
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self._body = None
+        
     
     def publish(self):
         if self.command == "submit":
@@ -43,14 +76,47 @@ class AppdfSender(object):
         self.connect()
         
     
-    def connect(self):
+    def send(self):
+        """ Sends the command once, without retries and messages. AppDF file
+        is streamed for submit commands only. Returns the server answer """
         data = {'test': 'test content'}
         #self.url = 'http://antares-software.ru/metapoinTest/appdf/test.php'
         #self.url = 'http://httpbin.org/post'
 
-        
+        if self._body is None:
+            files = self.file if self.command in ("submit", "submit-and-activate") else None
+            self._body = MultipartEncoder(data, files, self.chunk_size,
+                                          self.progress if files else None)
+        # The same body is sent again from the beginning
+        self._body.rewind()
+        headers = {"Content-Type": self._body.content_type}
+        return self.session.post(self.url, data=self._body, headers=headers,
+                                 auth=(self.username, self.password))
+
+    def request(self):
+        """ Sends the command. Failed uploads are sent again from the
+        beginning since the protocol has no way to resume them. Returns the
+        server answer """
+        for attempt in xrange(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                r = self.send()
+                if r.status_code < 500:
+                    break
+                print "\nServer error {}".format(r.status_code)
+            except requests.exceptions.RequestException as e:
+                print "\n", e
+                if attempt == UPLOAD_ATTEMPTS:
+                    raise
+            if attempt < UPLOAD_ATTEMPTS:
+                print "Try again in {} seconds...".format(RETRY_DELAY * attempt)
+                time.sleep(RETRY_DELAY * attempt)
+        if self.command in ("submit", "submit-and-activate") and self.progress:
+            print
+        return r
+
+    def connect(self):
         try:
-            r = requests.post(self.url, files=self.file, data=data, auth=(self.username, self.password))
+            r = self.request()
         except requests.exceptions.RequestException as e:
             print e
             sys.exit(1)
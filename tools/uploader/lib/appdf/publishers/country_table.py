@@ -0,0 +1,124 @@
+import json
+
+# Indexes rows of a table by their keys once, then sets checkboxes and
+# prices of many countries. Returns countries which were not found and
+# countries whose rows are blocked.
+TABLE_SCRIPT = """(function(spec) {
+    var first = function(xpath, context) {
+        return document.evaluate(xpath, context, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    };
+    var rows = document.evaluate(spec.rows, document, null,
+        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var index = {}, keys = [];
+    for (var i = 0; i < rows.snapshotLength; i++) {
+        var row = rows.snapshotItem(i);
+        var key = spec.key ? first(spec.key, row) : row;
+        if (!key) {
+            continue;
+        }
+        key = spec.key_attr ? key.getAttribute(spec.key_attr) : key.textContent;
+        key = (key || "").replace(/^\\s+|\\s+$/g, "");
+        if (!(key in index)) {
+            index[key] = row;
+            keys.push(key);
+        }
+    }
+    var find = function(country) {
+        if (country in index) {
+            return index[country];
+        }
+        if (!spec.exact) {
+            for (var i = 0; i < keys.length; i++) {
+                if (keys[i].indexOf(country) != -1) {
+                    return index[keys[i]];
+                }
+            }
+        }
+        return null;
+    };
+    var report = {missing: [], blocked: []};
+    var usable = function(country, row) {
+        if (!row) {
+            report.missing.push(country);
+            return false;
+        }
+        if (spec.blocked && first(spec.blocked, row)) {
+            report.blocked.push(country);
+            return false;
+        }
+        return true;
+    };
+    var check = function(row, state) {
+        var checkbox = first(spec.checkbox, row);
+        if (checkbox && checkbox.checked != state) {
+            checkbox.click();
+        }
+    };
+    var listed = [];
+    for (var i = 0; i < spec.countries.length; i++) {
+        var row = find(spec.countries[i]);
+        if (usable(spec.countries[i], row)) {
+            check(row, spec.state);
+            listed.push(row);
+        }
+    }
+    if (spec.others !== null) {
+        for (var i = 0; i < keys.length; i++) {
+            var row = index[keys[i]];
+            if (listed.indexOf(row) == -1 &&
+                    !(spec.blocked && first(spec.blocked, row))) {
+                check(row, spec.others);
+            }
+        }
+    }
+    for (var i = 0; i < spec.prices.length; i++) {
+        var row = find(spec.prices[i][0]);
+        var input = usable(spec.prices[i][0], row) && first(spec.price, row);
+        if (input) {
+            input.value = spec.prices[i][1];
+            var event = document.createEvent("HTMLEvents");
+            event.initEvent("change", true, true);
+            input.dispatchEvent(event);
+        }
+    }
+    return report;
+})(%s)"""
+
+
+class CountryTable(object):
+    """ Country table of a store form edited inside the page. Rows matching
+    `rows` XPath are indexed by the text of their `key` node (or its
+    `key_attr` attribute), a country matches a key equal to it or, unless
+    `exact`, containing it. `checkbox`, `price` and `blocked` are XPaths
+    relative to a row, rows matching `blocked` are never changed. """
+
+    def __init__(self, session, rows, key=None, key_attr=None, checkbox=None,
+                 price=None, blocked=None, exact=False):
+        self.session = session
+        self.spec = {"rows": rows, "key": key, "key_attr": key_attr,
+                     "checkbox": checkbox, "price": price, "blocked": blocked,
+                     "exact": exact}
+
+    def wait(self):
+        """ Waits for the first row of the table """
+        return self.session.at_xpath(self.spec["rows"])
+
+    def apply(self, countries=(), state=True, others=None, prices=()):
+        """ Sets checkboxes of `countries` to `state` and of all other rows
+        to `others` unless it is ``None``, then sets ``(country, price)``
+        pairs of `prices`, in a single script. Returns a dict with lists of
+        ``missing`` and ``blocked`` countries """
+        spec = dict(self.spec, countries=list(countries), state=state,
+                    others=others, prices=[[country, str(price)]
+                                           for country, price in prices])
+        report = self.session.eval_script(TABLE_SCRIPT % json.dumps(spec))
+        return {"missing": report["missing"], "blocked": report["blocked"]}
+
+
+def print_report(report):
+    """ Prints countries skipped by ``CountryTable.apply`` """
+    if report["missing"]:
+        print "Countries not found, skip:", ", ".join(report["missing"])
+    if report["blocked"]:
+        print "Countries blocked, skip:", ", ".join(report["blocked"])
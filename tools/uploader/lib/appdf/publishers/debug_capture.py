@@ -0,0 +1,147 @@
+import os
+import re
+import time
+import Queue
+import shutil
+import tempfile
+import threading
+import contextlib
+import collections
+from appdf.publishers import fanout
+
+DEFAULT_WIDTH = 1024
+DEFAULT_HEIGHT = 1024
+
+
+class DebugCapture(object):
+    """ Debug snapshots of browser sessions written to `debug_dir`. A
+    snapshot is a screenshot rendered at `width` x `height` or, with `html`,
+    the DOM of the page which is much cheaper to take. Snapshots are taken
+    at most once per `interval` seconds. With `ring` > 0 only the last `ring`
+    snapshots are kept and ``flush`` writes them, so capturing can stay on
+    and costs disk writes only when a publish fails. HTML files are written
+    by a background thread. """
+
+    def __init__(self, debug_dir, ring=0, width=DEFAULT_WIDTH,
+                 height=DEFAULT_HEIGHT, html=False, interval=0):
+        self.debug_dir = debug_dir
+        self.ring = ring
+        self.width = width
+        self.height = height
+        self.html = html
+        self.interval = interval
+        if not os.path.exists(debug_dir):
+            os.makedirs(debug_dir)
+        self._lock = threading.Lock()
+        self._last_take = 0
+        self._count = 0
+        self._entries = collections.deque()
+        self._spool_dir = None
+        self._queue = Queue.Queue()
+        self._writer = None
+
+    def take(self, session, action, state):
+        """ Captures the current page of `session`. Pages are rendered and
+        read without the lock, so sessions of other threads are not blocked """
+        with self._lock:
+            now = time.time()
+            if now - self._last_take < self.interval:
+                return
+            self._last_take = now
+            self._count += 1
+            if self.ring and not self.html and self._spool_dir is None:
+                self._spool_dir = tempfile.mkdtemp(prefix=".ring-", dir=self.debug_dir)
+            spool_path = self._spool_dir and os.path.join(
+                self._spool_dir, "{}.png".format(self._count))
+        file_name = _file_name("{}-{}-{}".format(now, action, state))
+        if self.html:
+            self._add(file_name + ".html", session.body())
+        elif self.ring:
+            # Screenshots are rendered into a spool directory and moved to
+            # their names on flush
+            session.render(spool_path, self.width, self.height)
+            self._add(file_name + ".png", spool_path)
+        else:
+            session.render(os.path.join(self.debug_dir, file_name + ".png"),
+                           self.width, self.height)
+
+    def _add(self, file_name, data):
+        with self._lock:
+            if not self.ring:
+                self._write(file_name, data)
+                return
+            self._entries.append((file_name, data))
+            if len(self._entries) > self.ring:
+                file_name, data = self._entries.popleft()
+                if not self.html and os.path.exists(data):
+                    os.remove(data)
+
+    def _write(self, file_name, data):
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=fanout.inherit_output(self._write_queued))
+            self._writer.daemon = True
+            self._writer.start()
+        self._queue.put((os.path.join(self.debug_dir, file_name), data))
+
+    def _write_queued(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, data = item
+            try:
+                if isinstance(data, unicode):
+                    data = data.encode("utf-8")
+                with open(path, "wb") as fp:
+                    fp.write(data)
+            except (IOError, OSError) as e:
+                print "Cannot write debug capture {}: {}".format(path, e)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """ Writes snapshots kept in the ring buffer """
+        with self._lock:
+            entries = list(self._entries)
+            self._entries.clear()
+            for file_name, data in entries:
+                if self.html:
+                    self._write(file_name, data)
+                elif os.path.exists(data):
+                    os.rename(data, os.path.join(self.debug_dir, file_name))
+        if entries:
+            print "Debug captures written:", len(entries)
+
+    def close(self):
+        """ Waits for queued writes, stops the writer and removes the spool
+        directory """
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer:
+            self._queue.put(None)
+            writer.join()
+        with self._lock:
+            if self._spool_dir:
+                shutil.rmtree(self._spool_dir, ignore_errors=True)
+                self._spool_dir = None
+                self._entries.clear()
+
+
+@contextlib.contextmanager
+def flushed_on_failure(capture):
+    """ Flushes `capture` if the block fails (including ``sys.exit``), then
+    closes it. `capture` may be ``None`` """
+    try:
+        yield
+    except BaseException:
+        if capture:
+            capture.flush()
+        raise
+    finally:
+        if capture:
+            capture.close()
+
+
+def _file_name(name):
+    return re.sub(r"[\s/\\:]+", "_", name)[:200]
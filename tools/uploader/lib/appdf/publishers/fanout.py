@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import threading
+import traceback
+
+
+class ThreadOutput(object):
+    """ Replacement of ``sys.stdout`` writing output of every registered
+    thread to its own stream, other threads write to `default` """
+
+    def __init__(self, default):
+        self.default = default
+        self._streams = {}
+
+    def register(self, stream):
+        self._streams[threading.current_thread().ident] = stream
+
+    def unregister(self):
+        self._streams.pop(threading.current_thread().ident, None)
+
+    def stream(self):
+        """ Returns the stream of the current thread """
+        return self._streams.get(threading.current_thread().ident, self.default)
+
+    def write(self, data):
+        self._streams.get(threading.current_thread().ident, self.default).write(data)
+
+    def flush(self):
+        self._streams.get(threading.current_thread().ident, self.default).flush()
+
+
+def inherit_output(target):
+    """ Wraps `target` of a new thread so that its output goes to the stream
+    of the calling thread, e.g. to the log of a store run """
+    output = sys.stdout
+    if not isinstance(output, ThreadOutput):
+        return target
+    stream = output.stream()
+    def run(*args, **kwargs):
+        output.register(stream)
+        try:
+            return target(*args, **kwargs)
+        finally:
+            output.unregister()
+    return run
+
+
+class StoreRun(object):
+    """ Publication to one store. `publish` is called in its own thread with
+    output written to `log_path` """
+
+    def __init__(self, store, publish, log_path):
+        self.store = store
+        self.publish = publish
+        self.log_path = log_path
+        self.status = "pending"
+        self.error = ""
+        self.duration = 0
+
+    def run(self, output):
+        started = time.time()
+        with open(self.log_path, "w", 1) as log:
+            output.register(log)
+            try:
+                self.publish()
+                self.status = "ok"
+            except SystemExit as e:
+                # Publishers exit on errors found in pages
+                self.status = "failed"
+                self.error = "exit code {}".format(e.code)
+            except Exception as e:
+                traceback.print_exc(file=log)
+                self.status = "failed"
+                self.error = str(e) or e.__class__.__name__
+            finally:
+                output.unregister()
+        self.duration = time.time() - started
+
+
+def run_concurrently(runs):
+    """ Runs publications to all stores at once, returns ``True`` if all of
+    them succeeded """
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        threads = []
+        for store_run in runs:
+            print "{}: started, log in {}".format(store_run.store, store_run.log_path)
+            thread = threading.Thread(target=store_run.run, args=(output,))
+            thread.start()
+            threads.append((store_run, thread))
+        for store_run, thread in threads:
+            thread.join()
+            print "{}: {}".format(store_run.store, store_run.status)
+    finally:
+        sys.stdout = output.default
+    return all(store_run.status == "ok" for store_run in runs)
+
+
+def format_results(runs):
+    """ Returns table of publication results """
+    rows = [("Store", "Status", "Time", "Log", "Error")]
+    for store_run in runs:
+        rows.append((store_run.store, store_run.status,
+                     "{:.0f}s".format(store_run.duration),
+                     store_run.log_path, store_run.error))
+    widths = [max(len(row[i]) for row in rows) for i in xrange(len(rows[0]))]
+    lines = []
+    for row in rows:
+        lines.append("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+    return "\n".join(lines)
+
+
+def log_path(log_dir, store):
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    return os.path.join(log_dir, "{}.log".format(store))
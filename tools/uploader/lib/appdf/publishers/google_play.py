@@ -1,66 +1,114 @@
 # -*- coding: utf-8 -*-
 
 import os
-import time
 import sys
+import Queue
+import threading
 import webkit_server
+from appdf.publishers import uploads
+from appdf.publishers import fanout
+from appdf.publishers.debug_capture import DebugCapture, flushed_on_failure
+from appdf.publishers.country_table import CountryTable, print_report
 
 IMAGE_LOAD_ATTEMPTS = 5
 TAB_LOAD_ATTEMPTS = 3
-
-def fill_element(element, value):
-    if value:
-        # Funny trick for multiline string
-        element.eval_script("""
-            var valueString = function(){{/*{}*/}}.toString().slice(15,-4);
-            node.value = valueString;
-            var event = document.createEvent("HTMLEvents");
-            event.initEvent("change", true, true);
-            node.dispatchEvent(event);
-        """.format(value))
-
-def fill(elements, values):
-    for i, value in enumerate(values):
-        if value:
-            fill_element(elements[i], value)
+LOCALE_FILL_ATTEMPTS = 3
+
+# AppDF fields filled in every localization of store listing
+LOCALIZED_FIELDS = ["title", "full_description", "short_description", "recent_changes"]
+SHARED_FIELDS = ["video", "website", "email", "phone", "privacy_policy_link"]
+PRICING_FIELDS = ["paid", "base_price", "local_prices", "availability_type",
+                  "availability_countries", "google_android_content_guidelines",
+                  "us_export_laws"]
+
+# Fields of store listing form in document order
+LISTING_INPUT = "(//fieldset//input)[{}]"
+LISTING_TEXTAREA = "(//fieldset//textarea)[{}]"
+LISTING_SELECT = "(//fieldset//select)[{}]"
+# Text fields of a localization: XPath, AppDF field and whether it is localized
+LISTING_FIELDS = [
+    (LISTING_INPUT.format(1), "title", True),
+    (LISTING_INPUT.format(2), "video", False),
+    (LISTING_INPUT.format(3), "website", False),
+    (LISTING_INPUT.format(4), "email", False),
+    (LISTING_INPUT.format(5), "phone", False),
+    (LISTING_INPUT.format(6), "privacy_policy_link", False),
+    (LISTING_TEXTAREA.format(1), "full_description", True),
+    (LISTING_TEXTAREA.format(2), "short_description", True),
+    (LISTING_TEXTAREA.format(3), "recent_changes", True),
+]
+
+# Rows of distribution table with a country, its checkbox and local price
+COUNTRY_ROWS = "//section/div[2]/div[3]/div/div[1]/div/div/div[3]/div/div[2]/div/div/table/tbody/tr"
+
+def fill(session, fields):
+    """ Sets values of ``(xpath, value)`` pairs in a single script, fields
+    with empty values are skipped. Returns XPaths of fields not found. """
+    fields = [(xpath, value) for xpath, value in fields if value]
+    found = session.fill_many(fields)
+    return [xpath for (xpath, value), ok in zip(fields, found) if not ok]
+
+
+def _normalize(value):
+    """ Text of a field as the page keeps it: line breaks and runs of spaces
+    may differ from AppDF """
+    if isinstance(value, str):
+        value = value.decode("utf-8")
+    return u" ".join(value.split())
 
 
 class GooglePlay(object):
-    def __init__(self, app, username, password, debug_dir=None):
+    def __init__(self, app, username, password, debug_dir=None, session=None,
+                 pool=None, upload_concurrency=uploads.DEFAULT_CONCURRENCY,
+                 journal=None, diff=None, capture=None):
         self.app = app
         self.username = username
         self.password = password
         self.debug_dir = debug_dir
-
-        self.session = webkit_server.Client()
-  
-        if self.debug_dir:
-            if not os.path.exists(self.debug_dir):
-                os.mkdir(self.debug_dir)
+        # Sessions for filling localizations concurrently
+        self.pool = pool
+        self.upload_concurrency = upload_concurrency
+        # Steps completed by previous runs are skipped
+        self.journal = journal
+        # Only fields and assets changed since the last publish are filled
+        self.diff = diff
+        # Debug snapshots of pages, taken if debug directory is set
+        self.capture = capture
+        if self.capture is None and self.debug_dir:
+            self.capture = DebugCapture(self.debug_dir)
+        # Languages filled entirely since their translations were removed
+        self.refilled_languages = set()
+
+        self.session = session or webkit_server.Client()
 
     # Publication process
     def publish(self):
-        self.store_locale(TAB_LOAD_ATTEMPTS)
+        with flushed_on_failure(self.capture):
+            self.store_locale(TAB_LOAD_ATTEMPTS)
 
-        self.session.visit("https://play.google.com/apps/publish/v2/")
-        self._debug("developer_console", "opened")
+            self.session.visit("https://play.google.com/apps/publish/v2/")
+            self._debug("developer_console", "opened")
 
-        self.login()
-        
-        # Select All applications menu
-        xpath = "//sidebar/nav/ul/li/a/div"
-        self.session.at_xpath(xpath).click()
-        
-        if self.ensure_application_listed():
-            self.open_app()
-        else:
-            self.create_app()
+            self.login()
 
-        self.fill_store_listing()
-        self.upload_apk()
-        self.fill_pricing_and_distribution()
+            # Select All applications menu
+            xpath = "//sidebar/nav/ul/li/a/div"
+            self.session.at_xpath(xpath).click()
 
-        self.restore_locale(TAB_LOAD_ATTEMPTS)
+            if self.ensure_application_listed():
+                self.open_app()
+            else:
+                self.create_app()
+
+            self._step("store_listing", self.fill_store_listing)
+            self._step("apk", self.upload_apk)
+            self._step("pricing_and_distribution", self.fill_pricing_and_distribution)
+            if self.journal:
+                self.journal.clear()
+            if self.diff:
+                self.diff.save()
+
+            self.restore_locale(TAB_LOAD_ATTEMPTS)
 
     # Checks
     def ensure_application_listed(self):
@@ -95,7 +143,7 @@ class GooglePlay(object):
         # Language tab
         lang_tab = self.session.at_xpath('//*[@id="nav-language"]')
         # Prevent loading stuck
-        time.sleep(1)
+        self.session.wait_for_idle(timeout=1)
         lang_tab.left_click()
         
         # Store current language
@@ -127,7 +175,7 @@ class GooglePlay(object):
         # Language tab
         lang_tab = self.session.at_xpath('//*[@id="nav-language"]')
         # Prevent loading stuck
-        time.sleep(1)
+        self.session.wait_for_idle(timeout=1)
         lang_tab.left_click()
         
         # Restore previous language
@@ -203,8 +251,7 @@ class GooglePlay(object):
             xpath = "//section/div/div/div/div/div/div[3]/div/ul/li[2]/a"
             self.session.at_xpath(xpath).click()
             buttons = self.session.xpath("//section/div[3]/div[2]/div/div/div/div/button[not(@disabled) and @data-lang-code and @aria-pressed='false']")
-            for button in buttons:
-                button.click()
+            self.session.click_all(buttons)
             # 'Remove' button
             xpath = "//section/div[3]/div[2]/div/div/div[2]/button[2]"
             self.session.at_xpath(xpath).click()
@@ -218,15 +265,16 @@ class GooglePlay(object):
         self._debug("add_languages", "popup_opened")
         new_lang = False
         
-        if hasattr(self.app.obj.application, "description-localization"):
-            for desc in self.app.obj.application["description-localization"]:
+        languages = self.app.languages()
+        if languages:
+            for lang in languages:
                 xpath = "//div[@class='popupContent']//tr/td/div/label/span[contains(text(), ' {}')]"
-                xpath = xpath.format(desc.attrib["language"])
+                xpath = xpath.format(lang)
                 
                 if self.session.at_xpath(xpath) != None:
                     new_lang = True
                     self.session.at_xpath(xpath).click()
-                    # self._debug("add_languages", desc.attrib["language"])
+                    # self._debug("add_languages", lang)
                 
             if not new_lang:
                 xpath = "//div[@class='popupContent']//footer/button[last()]"
@@ -255,99 +303,196 @@ class GooglePlay(object):
 
     def fill_store_listing(self):
         self._debug("fill_store_listing", "start")
-        self.remove_languages()
-        self.add_languages()
+        languages = self.app.languages()
+        if self._changed("languages", languages):
+            # All translations are removed and filled again
+            self.remove_languages()
+            self.add_languages()
+            self.refilled_languages = set(languages)
         self.select_language('en-US')
-        self.fill_localization("default")
+        if self._localization_changed("default"):
+            self.fill_localization("default")
         
-        if hasattr(self.app.obj.application, "description-localization"):
-            for desc in self.app.obj.application["description-localization"]:
-                self.select_language(desc.attrib["language"])
-                self.fill_localization(desc.attrib["language"])
+        languages = [lang for lang in languages if self._localization_changed(lang)]
+        if self.pool and len(languages) > 1:
+            url = self.session.url()
+            unfilled = self.fill_localizations_concurrently(url, languages)
+            self.session.visit(url)
+            self.ensure_application_header()
+            mismatched = self.check_localizations(
+                [lang for lang in languages if lang not in unfilled])
+            languages = [lang for lang in languages
+                         if lang in unfilled or lang in mismatched]
+
+        for lang in languages:
+            self.select_language(lang)
+            self.fill_localization(lang)
+
+    def fill_localizations_concurrently(self, url, languages):
+        """ Fills localizations in sessions leased from the pool, each session
+        takes the next language from a shared queue. Returns languages which
+        were not filled, re-raises the error if every worker failed """
+        queue = Queue.Queue()
+        for lang in languages:
+            queue.put(lang)
+        unfilled = []
+        errors = []
+
+        def worker():
+            lang = None
+            try:
+                with self.pool.lease(self.username) as session:
+                    publisher = GooglePlay(self.app, self.username, self.password,
+                                           self.debug_dir, session,
+                                           upload_concurrency=self.upload_concurrency,
+                                           diff=self.diff, capture=self.capture)
+                    publisher.refilled_languages = self.refilled_languages
+                    while True:
+                        try:
+                            lang = queue.get_nowait()
+                        except Queue.Empty:
+                            return
+                        if not publisher.fill_localization_at(url, lang):
+                            unfilled.append(lang)
+                        lang = None
+            except BaseException as e:
+                # Publisher calls sys.exit on fatal errors, it ends the worker
+                # only
+                print "Localization worker failed: {!r}".format(e)
+                errors.append(sys.exc_info())
+                if lang is not None:
+                    unfilled.append(lang)
+
+        # Workers write to the log of the store run which spawned them
+        threads = [threading.Thread(target=fanout.inherit_output(worker))
+                   for i in xrange(min(self.pool.size, len(languages)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors and len(errors) == len(threads):
+            exc_type, exc_value, exc_traceback = errors[0]
+            raise exc_type, exc_value, exc_traceback
+        while not queue.empty():
+            unfilled.append(queue.get_nowait())
+        if unfilled:
+            print "Localizations not filled concurrently:", ", ".join(unfilled)
+        self._debug("fill_store_listing", "localizations filled concurrently")
+        return [lang for lang in languages if lang in unfilled]
+
+    def fill_localization_at(self, url, lang):
+        """ Opens store listing by URL and fills the localization, retrying
+        on failure. Returns ``True`` on success. ``SystemExit`` of fatal
+        errors such as a failed login is not retried """
+        for i in xrange(LOCALE_FILL_ATTEMPTS):
+            try:
+                self.session.visit(url)
+                self.login()
+                self.ensure_application_header()
+                self.select_language(lang)
+                self.fill_localization(lang)
+                return True
+            except Exception as e:
+                print "Filling '{}' failed: {}. Try again...".format(lang, e)
+                if self.capture:
+                    self.capture.flush()
+        return False
+
+    def check_localizations(self, languages):
+        """ Returns languages whose saved text fields differ from AppDF """
+        mismatched = []
+        for lang in languages:
+            self.select_language(lang)
+            expected = [(xpath, self._app_value(lang, name, localized))
+                        for xpath, name, localized in LISTING_FIELDS]
+            expected = [(xpath, value) for xpath, value in expected if value]
+            found = self.session.xpath_many([xpath for xpath, value in expected])
+            if not all(found):
+                mismatched.append(lang)
+                continue
+            values = self.session.nodes_invoke([nodes[0] for nodes in found], "value")
+            if any(_normalize(saved) != _normalize(value)
+                   for saved, (xpath, value) in zip(values, expected)):
+                mismatched.append(lang)
+        if mismatched:
+            print "Localizations to fill again:", ", ".join(mismatched)
+        self._debug("fill_store_listing", "localizations checked")
+        return mismatched
     
     def fill_localization(self, lang):
-        inputs = self.session.css("fieldset input")
-        textareas = self.session.css("fieldset textarea")
-        selects = self.session.css("fieldset select")
-
-        assert len(inputs) == 7
-        assert len(textareas) == 3
-        assert len(selects) == 4
-        fill(inputs, [
-            self.app.title(lang),
-            self.app.video(),
-            self.app.website(),
-            self.app.email(),
-            self.app.phone(),
-            self.app.privacy_policy_link()
-        ])
-        fill(textareas, [
-            self.app.full_description(lang),
-            self.app.short_description(lang),
-            self.app.recent_changes(lang)
-        ])
-
+        fields = [(xpath, self._value(lang, name, localized))
+                  for xpath, name, localized in LISTING_FIELDS]
         if lang == "default":
-            fill_element(selects[0], self.app.type())
+            if self._fields_changed(["type", "category"]):
+                fields.append((LISTING_SELECT.format(1), self.app.type()))
+            if self._fields_changed(["rating"]):
+                fields.append((LISTING_SELECT.format(4), self.app.rating()))
+        missing = fill(self.session, fields)
+        assert not missing, "Store listing fields not found: " + ", ".join(missing)
 
-            #self.session.wait_while(lambda: selects[1].get_bool_attr("disabled"))
-            # Find category value
-            xpath = "//option[contains(text(), '{}')]"
-            xpath = xpath.format(self.app.category())
-            option = self.session.at_xpath(xpath)
-            fill_element(selects[1], option.value())
-
-            fill_element(selects[3], self.app.rating())
+        if lang == "default":
+            if self._fields_changed(["type", "category"]):
+                # Categories are listed after the type is changed
+                xpath = "//option[contains(text(), '{}')]"
+                xpath = xpath.format(self.app.category())
+                option = self.session.at_xpath(xpath)
+                fill(self.session, [(LISTING_SELECT.format(2), option.value())])
         
+            scheduler = uploads.UploadScheduler(self.session,
+                                                self.upload_concurrency,
+                                                IMAGE_LOAD_ATTEMPTS)
+
             # Upload screenshots
-            # Remove old screenshots first
-            xpath = "//section/div[3]/div[2]/div[3]/div[2]/div[1]/div/div[2]/div[1]/div[1]/div[1]/div[2]/div"
-            old_screenshots = self.session.xpath(xpath)
-            self._debug("screenshots", "start")
-            for old in old_screenshots:
-                if old.at_xpath("div[3]").get_attr("aria-hidden") != "true":
-                    old.at_xpath("div[3]/div[2]").click()
-            self._debug("screenshots", "old deleted")
-            screenshots = self.app.screenshot_paths()
-            # Dirty hack :(
-            self.upload_file(self.session.xpath(xpath)[-1].at_xpath("div[1]/input"), screenshots[0])
-
-            for screenshot in screenshots:
-                for i in xrange(IMAGE_LOAD_ATTEMPTS):
-                    if self.upload_image(self.session.xpath(xpath)[-1], screenshot):
-                        break
+            if self._asset_changed("screenshots", self.app.screenshot_files()):
+                # Remove old screenshots first
+                xpath = "//section/div[3]/div[2]/div[3]/div[2]/div[1]/div/div[2]/div[1]/div[1]/div[1]/div[2]/div"
+                old_screenshots = self.session.xpath(xpath)
+                self._debug("screenshots", "start")
+                for old in old_screenshots:
+                    if old.at_xpath("div[3]").get_attr("aria-hidden") != "true":
+                        old.at_xpath("div[3]/div[2]").click()
+                self._debug("screenshots", "old deleted")
+                screenshots = self.app.screenshot_paths()
+                # Dirty hack :(
+                self.upload_file(self.session.xpath(xpath)[-1].at_xpath("div[1]/input"), screenshots[0])
+
+                # A new screenshot slot appears only after the previous upload
+                previous = None
+                for screenshot in screenshots:
+                    previous = self._add_image_upload(
+                        scheduler, lambda xpath=xpath: self.session.xpath(xpath)[-1],
+                        screenshot, previous)
 
             # Upload app icon
-            app_icon_path = self.app.app_icon_path()
-            xpath = "//section/div[3]/div[2]/div[3]/div[2]/div[2]/div/div[2]/div/div"
-            app_icon_div = self.session.at_xpath(xpath)
-            for i in xrange(IMAGE_LOAD_ATTEMPTS):
-                if self.upload_image(app_icon_div, app_icon_path):
-                    break
+            if self._asset_changed("app_icon", self.app.app_icon_file()):
+                app_icon_path = self.app.app_icon_path()
+                xpath = "//section/div[3]/div[2]/div[3]/div[2]/div[2]/div/div[2]/div/div"
+                self._add_image_upload(scheduler, self._image_div(xpath), app_icon_path)
 
             # Upload large promo
             large_promo_path = self.app.large_promo_path()
-            if large_promo_path != None:
+            if large_promo_path != None and \
+                    self._asset_changed("large_promo", self.app.large_promo_file()):
                 xpath = "//section/div[3]/div[2]/div[3]/div[2]/div[2]/div[2]/div[2]"
-                large_promo_div = self.session.at_xpath(xpath)
-                for i in xrange(IMAGE_LOAD_ATTEMPTS):
-                    if self.upload_image(large_promo_div, large_promo_path):
-                        break
+                self._add_image_upload(scheduler, self._image_div(xpath), large_promo_path)
 
             # Upload small promo
             small_promo_path = self.app.small_promo_path()
-            if small_promo_path != None:
+            if small_promo_path != None and \
+                    self._asset_changed("small_promo", self.app.small_promo_file()):
                 xpath = "//section/div[3]/div[2]/div[3]/div[2]/div[2]/div[3]/div[2]"
-                small_promo_div = self.session.at_xpath(xpath)
-                for i in xrange(IMAGE_LOAD_ATTEMPTS):
-                    if self.upload_image(small_promo_div, small_promo_path):
-                        break
+                self._add_image_upload(scheduler, self._image_div(xpath), small_promo_path)
+
+            scheduler.run_or_raise()
 
         self.session.at_xpath("//section/h3/button").click()
         self._debug("fill_store_listing['"+lang+"']", "saved")
         assert self.ensure_saved_message()
 
     def fill_pricing_and_distribution(self):
+        if not self._fields_changed(PRICING_FIELDS):
+            print "Pricing and distribution are unchanged, skip"
+            return
         xpath = "//sidebar/nav/ol[2]/li[3]/a"
         self.session.at_xpath(xpath).click()
         if self.app.paid():
@@ -364,13 +509,10 @@ class GooglePlay(object):
                 self.session.at_xpath(xpath).click()
                 # Sel manual prices
                 local_prices = self.app.local_prices()
-                for local_price in local_prices:
-                    xpath = "//section/div[2]/div[3]/div/div[1]/div/div/div[3]/div/div[2]/div/div/table/tbody/tr/td[1]/div/label[contains(text(),'{}')]"
-                    xpath = xpath.format(local_price[0])
-                    country_row = self.session.at_xpath(xpath).at_xpath("../../..")
-                    price_input = country_row.at_xpath("td[2]/div/label/input")
-                    if price_input:
-                        price_input.set(local_price[1])
+                if local_prices:
+                    table = self._country_table()
+                    table.wait()
+                    print_report(table.apply(prices=local_prices))
         else:
             xpath = "//section/div[2]/div[2]/fieldset/label/div[2]/div/div/div/button[2]"
             self.session.at_xpath(xpath).click()
@@ -381,14 +523,14 @@ class GooglePlay(object):
             self.session.at_xpath(xpath).set("true")
         countries_list = self.app.availability_countries()
         if availability_type == "include" or availability_type == "exclude":
-            for country in countries_list:
-                xpath = "//section/div[2]/div[3]/div/div[1]/div/div/div[3]/div/div[2]/div/div/table/tbody/tr/td[1]/div/label[contains(text(),'{}')]"
-                xpath = xpath.format(country)
-                label = self.session.at_xpath(xpath)
-                if label.get_attr("data-country-checkbox") == "blocked":
-                    print country, "blocked, skip"
-                else:
-                    label.at_xpath("input").set("true" if availability_type == "include" else "false")
+            table = self._country_table()
+            table.wait()
+            if availability_type == "include":
+                # Only listed countries are checked
+                report = table.apply(countries_list, True, others=False)
+            else:
+                report = table.apply(countries_list, False)
+            print_report(report)
         if self.app.google_android_content_guidelines():
             xpath = "//section/div[2]/div[5]/fieldset/label[2]/div[2]/div/div/span/input"
             self.session.at_xpath(xpath).click()
@@ -399,7 +541,17 @@ class GooglePlay(object):
         self._debug("fill_pricing_and_distribution", "saved")
         assert self.ensure_saved_message()
 
+    def _country_table(self):
+        """ Distribution table keyed by country names """
+        return CountryTable(self.session, COUNTRY_ROWS, key="td[1]/div/label",
+                            checkbox="td[1]/div/label/input",
+                            price="td[2]/div/label/input",
+                            blocked="td[1]/div/label[@data-country-checkbox='blocked']")
+
     def upload_apk(self):
+        if not self._asset_changed("apk", self.app.apk_files()):
+            print "APK is unchanged, skip"
+            return
         xpath = "//sidebar/nav/ol[2]/li[1]/a"
         self.session.at_xpath(xpath).click()
         self.ensure_application_header()
@@ -420,7 +572,7 @@ class GooglePlay(object):
         apk_list = self.app.apk_paths()
         self.upload_file(input_file, apk_list[0])
         # 'div' with progress bar
-        self.session.wait_for(self.apk_loading_check, interval=0.1, timeout=120)
+        self.session.wait_for(self.apk_loading_check, timeout=120)
         print "\rUpload APK: done!", " " * 15
         # 'div' with warnings
         xpath = "/html/body/div[6]/div/div/div[1]/div[4]"
@@ -458,22 +610,94 @@ class GooglePlay(object):
         file_input.set(file_path)
 
     def upload_image(self, image_div, image_path):
+        self.start_image_upload(image_div, image_path)
+        self.session.wait_for(lambda: self.image_upload_state(image_div) is not None, timeout=60)
+        if not self.image_upload_state(image_div):
+            self.cancel_image_upload(image_div)
+            return False
+        print "Uploaded:", os.path.basename(image_path)
+        return True
+
+    def start_image_upload(self, image_div, image_path):
         # Delete old image if needed
         if image_div.at_xpath("div[1]").get_attr("aria-hidden") == "true":
             image_div.at_xpath("div[not(@aria-hidden='true')]/div[2]").click()
 
         self.upload_file(image_div.at_xpath("div[1]/input"), image_path)
-        self.session.wait_for(lambda: image_div.at_xpath("div[2]").get_attr("aria-hidden") == "true", timeout=60)
+
+    def image_upload_state(self, image_div):
+        """ ``None`` while the image is uploading, ``True`` if it is uploaded
+        and ``False`` on error """
+        if image_div.at_xpath("div[2]").get_attr("aria-hidden") != "true":
+            return None
+        return image_div.at_xpath("div[4]").get_attr("aria-hidden") == "true"
+
+    def cancel_image_upload(self, image_div):
         if image_div.at_xpath("div[4]").get_attr("aria-hidden") != "true":
             image_div.at_xpath("div[4]/div[2]").click()
-            return False
-        print "Uploaded:", os.path.basename(image_path)
-        return True
+
+    def _image_div(self, xpath):
+        return lambda: self.session.at_xpath(xpath)
+
+    def _add_image_upload(self, scheduler, find_div, image_path, follows=None):
+        """ Adds an upload to the image div returned by `find_div` when the
+        upload starts """
+        slot = {}
+        def start():
+            slot["div"] = find_div()
+            self.start_image_upload(slot["div"], image_path)
+        return scheduler.add(image_path, start,
+                             lambda: self.image_upload_state(slot["div"]),
+                             lambda: self.cancel_image_upload(slot["div"]),
+                             follows)
 
     # Helpers
+    def _changed(self, key, value):
+        return self.diff is None or self.diff.changed(key, value)
+
+    def _fields_changed(self, names, lang=None):
+        return self.diff is None or self.diff.fields_changed(self.app, names, lang)
+
+    def _asset_changed(self, key, filenames):
+        return self.diff is None or self.diff.asset_changed(key, self.app, filenames)
+
+    def _localization_changed(self, lang):
+        """ Checks whether anything filled in the localization is changed """
+        if self.diff is None:
+            return True
+        changed = self._fields_changed(LOCALIZED_FIELDS, lang)
+        changed |= self._fields_changed(SHARED_FIELDS)
+        if lang == "default":
+            changed |= self._fields_changed(["type", "category", "rating"])
+            changed |= self._asset_changed("screenshots", self.app.screenshot_files())
+            changed |= self._asset_changed("app_icon", self.app.app_icon_file())
+            changed |= self._asset_changed("large_promo", self.app.large_promo_file())
+            changed |= self._asset_changed("small_promo", self.app.small_promo_file())
+        return changed or lang in self.refilled_languages
+
+    def _app_value(self, lang, name, localized=True):
+        if localized:
+            return getattr(self.app, name)(lang)
+        return getattr(self.app, name)()
+
+    def _value(self, lang, name, localized=True):
+        """ Returns value of AppDF field to fill in the localization or
+        ``None`` if the field is unchanged since the last publish """
+        value = self._app_value(lang, name, localized)
+        key = "{}:{}".format(lang, name) if localized else name
+        if self._changed(key, value) or lang in self.refilled_languages:
+            return value
+        return None
+
+    def _step(self, name, action):
+        if self.journal:
+            self.journal.run(name, action)
+        else:
+            action()
+
     def _debug(self, action, state):
         print action + " : " + state
         
-        if self.debug_dir:
-            file_name = "{}-{}-{}.png".format(time.time(), action, state)
-            self.session.render(os.path.join(self.debug_dir, file_name))
+        if self.capture:
+            self.capture.take(self.session, action, state)
+
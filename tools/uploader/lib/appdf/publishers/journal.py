@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import tempfile
+
+DEFAULT_JOURNAL_DIR = os.path.join("~", ".appdf", "journal")
+
+
+def apk_hash(app):
+    """ Returns SHA-1 hex digest of all APK files of the AppDF """
+    digest = hashlib.sha1()
+    for apk_file in app.apk_files():
+        digest.update(app.asset_hash(apk_file))
+    return digest.hexdigest()
+
+
+def write_json(file_path, data):
+    """ Writes JSON file through a temporary file, so a crash never leaves
+    a truncated file behind """
+    dir_name = os.path.dirname(file_path)
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+    with os.fdopen(fd, "w") as fp:
+        json.dump(data, fp, indent=2, sort_keys=True)
+    os.rename(tmp_path, file_path)
+
+
+class Journal(object):
+    """ Steps of a publish run completed for the store, package and APK.
+    The journal is kept in a JSON file in `journal_dir` so a failed run can be
+    resumed: steps that already succeeded are skipped by ``run``. """
+
+    def __init__(self, store, package, apk_hash, journal_dir=DEFAULT_JOURNAL_DIR):
+        self.store = store
+        self.package = package
+        self.apk_hash = apk_hash
+        self.journal_dir = os.path.expanduser(journal_dir)
+        file_name = "{}-{}-{}.json".format(store, package, apk_hash)
+        self.file_path = os.path.join(self.journal_dir, file_name)
+        self.steps = self._load()
+
+    @classmethod
+    def for_app(cls, store, app, journal_dir=DEFAULT_JOURNAL_DIR):
+        return cls(store, app.package(), apk_hash(app), journal_dir)
+
+    def done(self, step):
+        return step in self.steps
+
+    def complete(self, step):
+        if step not in self.steps:
+            self.steps.append(step)
+            self._save()
+
+    def run(self, step, action, *args):
+        """ Calls `action` unless the step is already completed, the step is
+        recorded only if `action` returns without raising """
+        if self.done(step):
+            print "Skip {} : completed by previous run".format(step)
+            return
+        action(*args)
+        self.complete(step)
+
+    def clear(self):
+        """ Forgets all steps, called when the whole run succeeded """
+        self.steps = []
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return []
+        try:
+            with open(self.file_path) as fp:
+                return list(json.load(fp)["steps"])
+        except (ValueError, KeyError, TypeError):
+            print "Journal `{}' is broken, start from scratch".format(self.file_path)
+            return []
+
+    def _save(self):
+        write_json(self.file_path, {
+            "store": self.store,
+            "package": self.package,
+            "apk-hash": self.apk_hash,
+            "steps": self.steps
+        })
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+from appdf.publishers.journal import write_json
+
+DEFAULT_MANIFEST_DIR = os.path.join("~", ".appdf", "manifests")
+
+
+def value_hash(value):
+    """ Returns SHA-1 hex digest of JSON representation of the value, lxml
+    elements are represented by their text """
+    data = json.dumps(value, sort_keys=True, default=unicode)
+    return hashlib.sha1(data).hexdigest()
+
+
+class Diff(object):
+    """ Compares AppDF fields and assets with the manifest of hashes saved
+    after the previous successful publish to the store. Hashes computed
+    during the run become the new manifest on ``save``. Without a manifest
+    everything is changed. """
+
+    def __init__(self, store, package, manifest_dir=DEFAULT_MANIFEST_DIR):
+        self.store = store
+        self.package = package
+        file_name = "{}-{}.json".format(store, package)
+        self.file_path = os.path.join(os.path.expanduser(manifest_dir), file_name)
+        self.previous = self._load()
+        self.current = {}
+
+    @classmethod
+    def for_app(cls, store, app, manifest_dir=DEFAULT_MANIFEST_DIR):
+        return cls(store, app.package(), manifest_dir)
+
+    def changed(self, key, value):
+        self.current[key] = value_hash(value)
+        return self.previous.get(key) != self.current[key]
+
+    def fields_changed(self, app, names, lang=None):
+        """ Checks values of AppDF accessors, localized ones if `lang` is
+        given. Every field is hashed, so all of them get into the manifest """
+        changed = False
+        for name in names:
+            if lang is None:
+                changed |= self.changed(name, getattr(app, name)())
+            else:
+                key = "{}:{}".format(lang, name)
+                changed |= self.changed(key, getattr(app, name)(lang))
+        return changed
+
+    def asset_changed(self, key, app, filenames):
+        """ Checks content of AppDF members, `filenames` is a name, a list of
+        names or ``None`` """
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        hashes = [app.asset_hash(name) for name in filenames if name]
+        return self.changed("asset:" + key, hashes)
+
+    def save(self):
+        """ Saves hashes as the manifest of a successful publish. Fields
+        not checked during the run keep previous hashes """
+        manifest = dict(self.previous)
+        manifest.update(self.current)
+        write_json(self.file_path, {
+            "store": self.store,
+            "package": self.package,
+            "hashes": manifest
+        })
+        self.previous = manifest
+
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return {}
+        try:
+            with open(self.file_path) as fp:
+                return dict(json.load(fp)["hashes"])
+        except (ValueError, KeyError, TypeError):
+            print "Manifest `{}' is broken, publish everything".format(self.file_path)
+            return {}
@@ -0,0 +1,105 @@
+import os
+import uuid
+import mimetypes
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class MultipartEncoder(object):
+    """ File-like multipart/form-data body streaming files in chunks of
+    `chunk_size` bytes instead of building the whole body in memory.
+    `fields` maps names to strings, `files` maps names to ``(filename,
+    file object)`` pairs like ``files`` argument of requests. `progress` is
+    called with numbers of bytes sent and total after every read. """
+
+    def __init__(self, fields=None, files=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary={}".format(self.boundary)
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._parts = []
+        for name, value in sorted((fields or {}).items()):
+            self._parts.append(self._header(name) + "\r\n" + _encode(value) + "\r\n")
+        for name, (filename, fp) in sorted((files or {}).items()):
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            header = self._header(name, os.path.basename(filename), content_type)
+            self._parts.append(header + "\r\n")
+            self._parts.append(_FilePart(fp))
+            self._parts.append("\r\n")
+        self._parts.append("--{}--\r\n".format(self.boundary))
+        self.len = sum(_part_length(part) for part in self._parts)
+        self.rewind()
+
+    def _header(self, name, filename=None, content_type=None):
+        disposition = 'form-data; name="{}"'.format(name)
+        if filename is not None:
+            disposition += '; filename="{}"'.format(_encode(filename))
+        header = "--{}\r\nContent-Disposition: {}\r\n".format(self.boundary, disposition)
+        if content_type:
+            header += "Content-Type: {}\r\n".format(content_type)
+        return header
+
+    def rewind(self):
+        """ Starts the body from the beginning, used to send it again """
+        self.sent = 0
+        self._index = 0
+        self._offset = 0
+        for part in self._parts:
+            if isinstance(part, _FilePart):
+                part.rewind()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        size = min(size, self.chunk_size)
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, _FilePart):
+                chunk = part.read(size)
+            else:
+                chunk = part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+            if not chunk:
+                self._index += 1
+                self._offset = 0
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        data = "".join(chunks)
+        self.sent += len(data)
+        if self.progress and data:
+            self.progress(self.sent, self.len)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), "")
+
+    def __len__(self):
+        return self.len
+
+
+class _FilePart(object):
+    def __init__(self, fp):
+        self.fp = fp
+        self.start = fp.tell()
+        fp.seek(0, os.SEEK_END)
+        self.length = fp.tell() - self.start
+        fp.seek(self.start)
+
+    def rewind(self):
+        self.fp.seek(self.start)
+
+    def read(self, size):
+        return self.fp.read(size)
+
+
+def _part_length(part):
+    return part.length if isinstance(part, _FilePart) else len(part)
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
@@ -0,0 +1,125 @@
+import threading
+import contextlib
+import webkit_server
+
+DEFAULT_POOL_SIZE = 1
+DEFAULT_MAX_USES = 20
+
+
+class PooledSession(object):
+    """ A webkit_server process with a client connected to it. `account` is
+    the user whose cookies the session holds, `uses` counts leases. """
+
+    def __init__(self, server_factory):
+        self.server = server_factory()
+        self.client = webkit_server.Client(webkit_server.ServerConnection(self.server))
+        self.account = None
+        self.uses = 0
+
+    def reset(self, keep_cookies=True):
+        """ Resets the page, keeps cookies (and so the login) if asked. """
+        cookies = self.client.cookies() if keep_cookies else []
+        self.client.reset()
+        self.client.set_header("User-Agent", webkit_server.DEFAULT_USER_AGENT)
+        for cookie in cookies:
+            self.client.set_cookie(cookie)
+        if not keep_cookies:
+            self.account = None
+
+    def kill(self):
+        self.server.kill()
+
+
+class SessionPool(object):
+    """ Keeps `size` warm webkit_server processes and leases their clients to
+    publishers. Sessions stay logged in between leases of the same account,
+    cookies are cleared before a session is given to another account. A
+    process is replaced after `max_uses` leases, a process which cannot be
+    replaced gives up its slot and decreases `size`. """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_uses=DEFAULT_MAX_USES,
+                 server_factory=webkit_server.Server):
+        self.size = size
+        self._server_factory = server_factory
+        self._max_uses = max_uses
+        self._condition = threading.Condition()
+        self._idle = [PooledSession(server_factory) for i in xrange(size)]
+        self._closed = False
+
+    def acquire(self, account=None):
+        """ Waits for an idle session, preferring one logged in as `account`.
+        """
+        with self._condition:
+            while not self._idle:
+                if self._closed:
+                    raise RuntimeError("Session pool is closed")
+                if not self.size:
+                    raise RuntimeError("Session pool has no sessions left")
+                self._condition.wait()
+            if self._closed:
+                raise RuntimeError("Session pool is closed")
+            session = self._idle[0]
+            for idle in self._idle:
+                if idle.account == account:
+                    session = idle
+                    break
+            self._idle.remove(session)
+
+        session.uses += 1
+        try:
+            if session.account != account:
+                session.client.clear_cookies()
+                session.account = account
+        except Exception:
+            self.release(session)
+            raise
+        return session
+
+    def release(self, session):
+        """ Returns the session to the pool, resetting or recycling it. """
+        with self._condition:
+            closed = self._closed
+        if closed:
+            session.kill()
+            return
+        try:
+            if session.uses >= self._max_uses:
+                raise RuntimeError("Session is used up")
+            session.reset()
+        except Exception:
+            session.kill()
+            try:
+                session = PooledSession(self._server_factory)
+            except Exception as e:
+                # Not raised: release runs while the lease may be failing
+                # with an error of its own
+                print "Cannot start a pooled session: {}".format(e)
+                session = None
+
+        with self._condition:
+            if session is None:
+                self.size -= 1
+                self._condition.notify_all()
+            elif self._closed:
+                session.kill()
+            else:
+                self._idle.append(session)
+                self._condition.notify()
+
+    @contextlib.contextmanager
+    def lease(self, account=None):
+        """ Context manager yielding a ``webkit_server.Client``. """
+        session = self.acquire(account)
+        try:
+            yield session.client
+        finally:
+            self.release(session)
+
+    def close(self):
+        """ Kills idle processes, leased ones are killed when released. """
+        with self._condition:
+            self._closed = True
+            for session in self._idle:
+                session.kill()
+            self._idle = []
+            self._condition.notify_all()
@@ -0,0 +1,175 @@
+import sys
+import time
+import json
+import threading
+import multiprocessing.pool
+import requests
+from appdf.publishers.appdf_sender import AppdfSender, create_session
+
+# Return codes of the submit protocol
+CODES = ("active", "inactive", "ownership-confirmation-required",
+         "aproval-pending-active", "aproval-pending-inactive", "rejected",
+         "version-already-exists", "newer-version-exists",
+         "unsupported-appdf-version", "wrong-appdf-format")
+# Codes which change without resubmission of the application
+PENDING_CODES = ("ownership-confirmation-required", "aproval-pending-active",
+                 "aproval-pending-inactive")
+
+DEFAULT_WORKERS = 8
+DEFAULT_RATE = 10.0 # requests per second
+DEFAULT_INTERVAL = 60
+MAX_INTERVAL = 3600
+BACKOFF = 2
+ATTEMPTS = 3
+
+TABLE_COLUMNS = ("url", "package", "code", "version", "terminal", "message", "error")
+
+
+def read_targets(file_path, url=None):
+    """ Reads `URL PACKAGE` pairs, one per line. Lines with a package only
+    refer to `url`. Empty lines and lines starting with # are skipped """
+    targets = []
+    with open(file_path) as fp:
+        for line in fp:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) == 1:
+                if not url:
+                    raise ValueError("No store URL for package `{}'".format(fields[0]))
+                fields.insert(0, url)
+            targets.append((fields[0], fields[1]))
+    return targets
+
+
+class RateLimiter(object):
+    """ Spaces calls of ``wait`` from all threads at least 1 / `rate`
+    seconds apart """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class StatusPoller(object):
+    """ Checks statuses of many packages with the `check` command of the
+    submit protocol. Requests are sent by `workers` threads over a shared
+    keep-alive session, no more than `rate` per second. """
+
+    def __init__(self, username, password, workers=DEFAULT_WORKERS,
+                 rate=DEFAULT_RATE, session=None):
+        self.username = username
+        self.password = password
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.session = session or create_session()
+
+    def check(self, target):
+        """ Returns status record of `(url, package)` pair. Failed requests
+        are sent again up to `ATTEMPTS` times, every attempt waits for the
+        rate limiter """
+        url, package = target
+        record = dict.fromkeys(TABLE_COLUMNS)
+        record.update(url=url, package=package)
+        sender = AppdfSender(self.username, self.password, url, "check",
+                             package, None, session=self.session, progress=None)
+        sender.url += "&package=%s" % package
+        for attempt in xrange(1, ATTEMPTS + 1):
+            self.limiter.wait()
+            try:
+                r = sender.send()
+            except requests.exceptions.RequestException as e:
+                record["error"] = str(e)
+            else:
+                if r.status_code < 500:
+                    record["error"] = None
+                    break
+                record["error"] = "Server error {}".format(r.status_code)
+            sys.stderr.write("{} {}: {} (attempt {} of {})\n".format(
+                url, package, record["error"], attempt, ATTEMPTS))
+        else:
+            # Connection and server errors are transient, the package is
+            # checked again
+            record["terminal"] = False
+            return record
+        try:
+            result = json.loads(r.text)
+            record.update(code=result["code"], version=result.get("version"),
+                          message=result.get("message"))
+            if record["code"] not in CODES:
+                record["error"] = "Unknown code"
+            record["terminal"] = record["code"] not in PENDING_CODES
+        except (ValueError, KeyError, TypeError):
+            record["error"] = "Invalid server answer"
+            record["terminal"] = True
+        return record
+
+    def poll(self, targets):
+        """ Checks all targets concurrently, yields records as they come """
+        pool = multiprocessing.pool.ThreadPool(min(self.workers, len(targets)) or 1)
+        try:
+            for record in pool.imap_unordered(self.check, targets):
+                yield record
+        finally:
+            pool.close()
+            pool.join()
+
+    def watch(self, targets, interval=DEFAULT_INTERVAL, max_interval=MAX_INTERVAL,
+              timeout=None):
+        """ Checks targets until they reach terminal states, yields every
+        record. The delay of a package doubles after each check which does
+        not change its status, up to `max_interval` """
+        started = time.time()
+        state = dict((target, {"delay": interval, "next": 0, "code": None})
+                     for target in targets)
+        while state:
+            now = time.time()
+            if timeout is not None and now - started >= timeout:
+                break
+            due = [target for target in targets
+                   if target in state and state[target]["next"] <= now]
+            for record in self.poll(due):
+                target = (record["url"], record["package"])
+                yield record
+                if record["terminal"]:
+                    del state[target]
+                    continue
+                entry = state[target]
+                if record["code"] != entry["code"]:
+                    entry["delay"] = interval
+                else:
+                    entry["delay"] = min(entry["delay"] * BACKOFF, max_interval)
+                entry["code"] = record["code"]
+                entry["next"] = time.time() + entry["delay"]
+            if state:
+                wake = min(entry["next"] for entry in state.values())
+                if timeout is not None:
+                    wake = min(wake, started + timeout)
+                time.sleep(max(0, wake - time.time()))
+
+
+def write_table(records, stream=None):
+    """ Writes records as tab separated table with a header """
+    stream = stream or sys.stdout
+    stream.write("\t".join(TABLE_COLUMNS) + "\n")
+    for record in records:
+        cells = []
+        for column in TABLE_COLUMNS:
+            value = record[column]
+            if value is None:
+                value = ""
+            elif isinstance(value, bool):
+                value = "yes" if value else "no"
+            elif isinstance(value, unicode):
+                value = value.encode("utf-8")
+            cells.append(" ".join(str(value).split()))
+        stream.write("\t".join(cells) + "\n")
@@ -0,0 +1,135 @@
+import os
+import time
+import webkit_server
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_ATTEMPTS = 5
+DEFAULT_TIMEOUT = 60
+
+PENDING = "pending"
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+
+
+class UploadError(Exception):
+    """ Raised when some files could not be uploaded """
+
+
+class Upload(object):
+    """ A single file input slot. `start` selects the file in the input,
+    `check` returns ``None`` while the upload is in progress, ``True`` when
+    it is done and ``False`` when it failed, `cancel` cleans the slot up after
+    a failure. A slot starts only after the slot it `follows` is done. """
+
+    def __init__(self, file_path, start, check, cancel=None, follows=None):
+        self.file_path = file_path
+        self.name = os.path.basename(file_path)
+        self.start = start
+        self.check = check
+        self.cancel = cancel
+        self.follows = follows
+        self.state = PENDING
+        self.attempts = 0
+        self.started = None
+
+    def ready(self):
+        return self.follows is None or self.follows.state == DONE
+
+
+class UploadScheduler(object):
+    """ Starts up to `concurrency` uploads at once and waits for all of them,
+    so the upload times of several images overlap. Only failed or timed out
+    slots are started again, at most `attempts` times each. """
+
+    def __init__(self, session, concurrency=DEFAULT_CONCURRENCY,
+                 attempts=DEFAULT_ATTEMPTS, timeout=DEFAULT_TIMEOUT):
+        self.session = session
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self.timeout = timeout
+        self.uploads = []
+
+    def add(self, file_path, start, check, cancel=None, follows=None):
+        upload = Upload(file_path, start, check, cancel, follows)
+        self.uploads.append(upload)
+        return upload
+
+    def run(self):
+        """ Uploads all files, returns the list of uploads that failed """
+        while True:
+            self._start_pending()
+            active = [upload for upload in self.uploads
+                      if upload.state == UPLOADING]
+            if not active:
+                break
+            try:
+                self.session.wait_for(lambda: self._poll(active),
+                                      timeout=self._time_left(active))
+            except webkit_server.WaitTimeoutError:
+                pass
+            self._expire(active)
+        failed = [upload for upload in self.uploads if upload.state != DONE]
+        for upload in failed:
+            print "Upload failed:", upload.name
+        return failed
+
+    def run_or_raise(self):
+        """ Uploads all files, raises ``UploadError`` if any of them failed """
+        failed = self.run()
+        if failed:
+            raise UploadError("Uploads failed: " +
+                              ", ".join(upload.name for upload in failed))
+
+    def _start_pending(self):
+        active = len([upload for upload in self.uploads
+                      if upload.state == UPLOADING])
+        for upload in self.uploads:
+            if active >= self.concurrency:
+                break
+            if upload.state == PENDING and upload.ready():
+                upload.attempts += 1
+                upload.started = time.time()
+                upload.state = UPLOADING
+                upload.start()
+                active += 1
+                self._progress(upload)
+
+    def _poll(self, active):
+        """ Updates states of active uploads, returns ``True`` if any of them
+        has finished """
+        finished = False
+        for upload in active:
+            result = upload.check()
+            if result is None:
+                continue
+            finished = True
+            if result:
+                upload.state = DONE
+            else:
+                self._fail(upload)
+            self._progress(upload)
+        return finished
+
+    def _expire(self, active):
+        for upload in active:
+            if upload.state == UPLOADING and \
+                    time.time() - upload.started > self.timeout:
+                self._fail(upload)
+                self._progress(upload)
+
+    def _fail(self, upload):
+        if upload.cancel:
+            upload.cancel()
+        if upload.attempts < self.attempts:
+            upload.state = PENDING
+        else:
+            upload.state = FAILED
+
+    def _time_left(self, active):
+        return max(0, min(upload.started for upload in active) +
+                   self.timeout - time.time())
+
+    def _progress(self, upload):
+        print "Upload {} ({}/{}): {}".format(upload.name, upload.attempts,
+                                             self.attempts, upload.state)
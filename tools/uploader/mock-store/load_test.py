@@ -0,0 +1,136 @@
+#!/usr/bin/python
+""" Load test of AppDF upload path: submits AppDF files concurrently with
+AppdfSender and reports throughput and latency percentiles """
+
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import threading
+import collections
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.realpath(os.path.join(current_dir, "..", "lib")))
+
+import requests
+from appdf.publishers.appdf_sender import AppdfSender, create_session
+
+SAMPLES_GLOB = os.path.join(current_dir, "..", "..", "..", "samples", "*", "*.appdf")
+
+
+def percentile(values, percent):
+    """ Returns percentile of sorted values by nearest rank """
+    if not values:
+        return 0
+    rank = max(0, int(round(percent / 100.0 * len(values) + 0.5)) - 1)
+    return values[min(rank, len(values) - 1)]
+
+
+class LoadTest(object):
+    def __init__(self, url, files, command, username, password):
+        self.url = url
+        self.files = files
+        self.command = command
+        self.username = username
+        self.password = password
+        self.latencies = []
+        self.codes = collections.Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def run(self, requests_count, concurrency):
+        """ Sends `requests_count` requests from `concurrency` threads,
+        returns wall time """
+        self._left = requests_count
+        started = time.time()
+        threads = [threading.Thread(target=self._worker) for i in xrange(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - started
+
+    def _take(self):
+        with self._lock:
+            if self._left <= 0:
+                return None
+            self._left -= 1
+            self._next += 1
+            return self.files[self._next % len(self.files)]
+
+    def _worker(self):
+        # requests sessions are not shared between threads
+        session = create_session()
+        while True:
+            file_path = self._take()
+            if file_path is None:
+                return
+            with open(file_path, "rb") as fp:
+                sender = AppdfSender(self.username, self.password, self.url,
+                                     self.command, None, {"file": (file_path, fp)},
+                                     session=session, progress=None)
+                started = time.time()
+                try:
+                    # A single request per sample: retries would hide errors
+                    # and add their delays to the latency
+                    r = sender.send()
+                    try:
+                        code = json.loads(r.text)["code"] or "http-{}".format(r.status_code)
+                    except (ValueError, KeyError):
+                        code = "http-{}".format(r.status_code)
+                except requests.exceptions.RequestException:
+                    code = "connection-error"
+                latency = time.time() - started
+            with self._lock:
+                self.latencies.append(latency)
+                self.codes[code] += 1
+                self.bytes_sent += os.path.getsize(file_path)
+
+    def report(self, wall_time):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        lines = [
+            "requests: {}".format(count),
+            "time: {:.2f}s".format(wall_time),
+            "throughput: {:.2f} req/s, {:.2f} MB/s".format(
+                count / wall_time, self.bytes_sent / wall_time / 1024 / 1024),
+            "latency p50: {:.3f}s".format(percentile(latencies, 50)),
+            "latency p99: {:.3f}s".format(percentile(latencies, 99)),
+            "latency max: {:.3f}s".format(latencies[-1] if latencies else 0),
+        ]
+        for code, number in sorted(self.codes.items()):
+            lines.append("code {}: {}".format(code, number))
+        return "\n".join(lines)
+
+
+def parse_args():
+    argument_parser = argparse.ArgumentParser(description="AppDF upload load test")
+    argument_parser.add_argument("url", help="Store URL, e.g. http://127.0.0.1:8080")
+    argument_parser.add_argument("files", metavar="FILE", nargs="*",
+                                 help="AppDF files to submit, samples by default")
+    argument_parser.add_argument("--requests", "-n", type=int, default=100,
+                                 help="Total number of submissions")
+    argument_parser.add_argument("--concurrency", "-c", type=int, default=10,
+                                 help="Number of concurrent submissions")
+    argument_parser.add_argument("--command", default="submit",
+                                 choices=["submit", "submit-and-activate"])
+    argument_parser.add_argument("--username", default="", help="Username")
+    argument_parser.add_argument("--password", default="", help="Password")
+    return argument_parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    files = args.files or sorted(glob.glob(SAMPLES_GLOB))
+    if not files:
+        print "No AppDF files to submit"
+        sys.exit(1)
+    load_test = LoadTest(args.url, files, args.command, args.username, args.password)
+    wall_time = load_test.run(args.requests, args.concurrency)
+    print load_test.report(wall_time)
+
+if __name__ == "__main__":
+    main()
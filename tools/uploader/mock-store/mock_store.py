@@ -0,0 +1,214 @@
+#!/usr/bin/python
+""" Local stand-in for an appstore implementing the AppDF submit protocol
+(specification/appdf_submit_protocol_spec.md) with configurable latency and
+error injection """
+
+import os
+import cgi
+import json
+import time
+import random
+import base64
+import shutil
+import hashlib
+import zipfile
+import argparse
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+import lxml.etree
+
+DEFAULT_PORT = 8080
+
+
+class Store(object):
+    """ Submitted applications by package. An application waits for
+    approval `approval_delay` seconds after submission. """
+
+    def __init__(self, approval_delay=0):
+        self.approval_delay = approval_delay
+        self._lock = threading.Lock()
+        self._apps = {}
+
+    def submit(self, package, apk_hash, activate):
+        with self._lock:
+            app = self._apps.setdefault(package, {"version": 0, "apks": set()})
+            if apk_hash in app["apks"]:
+                return "version-already-exists", app
+            app["apks"].add(apk_hash)
+            app["version"] += 1
+            app["submitted"] = time.time()
+            app["activate"] = activate
+            return self._code(app), app
+
+    def activate(self, package):
+        with self._lock:
+            app = self._apps.get(package)
+            if app:
+                app["activate"] = True
+                return self._code(app), app
+            return None, None
+
+    def check(self, package):
+        with self._lock:
+            app = self._apps.get(package)
+            if app:
+                return self._code(app), app
+            return None, None
+
+    def _code(self, app):
+        approved = time.time() - app["submitted"] >= self.approval_delay
+        if app["activate"]:
+            return "active" if approved else "aproval-pending-active"
+        return "inactive" if approved else "aproval-pending-inactive"
+
+
+def read_appdf(fp):
+    """ Returns package name and hash of APK files of AppDF file object """
+    with zipfile.ZipFile(fp) as archive:
+        description = lxml.etree.fromstring(archive.read("description.xml"))
+        package = description.find("application").get("package")
+        if not package:
+            raise ValueError("No package")
+        digest = hashlib.sha1()
+        for name in description.xpath("//apk-files/apk-file/text()"):
+            with archive.open(name.strip()) as apk:
+                shutil.copyfileobj(apk, _HashWriter(digest))
+        return package, digest.hexdigest()
+
+
+class _HashWriter(object):
+    def __init__(self, digest):
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        options = self.server.options
+        time.sleep(max(0, random.gauss(options.latency, options.jitter)))
+        if random.random() < options.drop_rate:
+            # Connection is closed without an answer
+            self.close_connection = 1
+            return
+        if random.random() < options.error_rate:
+            self._skip_body()
+            return self._answer(503, {"code": "", "message": "Injected error"})
+        if not self._authorized():
+            self._skip_body()
+            return self._answer(401, {"code": "", "message": "Unauthorized"},
+                                {"WWW-Authenticate": 'Basic realm="appdf"'})
+
+        url = urlparse.urlparse(self.path)
+        if url.path.rstrip("/") != "/appdf":
+            self._skip_body()
+            return self._answer(404, {"code": "", "message": "Not found"})
+        query = dict(urlparse.parse_qsl(url.query))
+        command = query.get("command")
+        if command in ("submit", "submit-and-activate"):
+            self._submit(command == "submit-and-activate")
+        elif command in ("activate", "check"):
+            self._skip_body()
+            package = query.get("package", "")
+            code, app = getattr(self.server.store, command)(package)
+            if code is None:
+                return self._answer(404, self._result("", "Unknown package", package))
+            self._answer(200, self._result(code, "", package, app["version"]))
+        else:
+            self._skip_body()
+            self._answer(400, {"code": "", "message": "Unknown command"})
+
+    def _submit(self, activate):
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers,
+                                environ={"REQUEST_METHOD": "POST"})
+        if "file" not in form or not form["file"].file:
+            return self._answer(200, self._result("wrong-appdf-format", "No AppDF file"))
+        try:
+            package, apk_hash = read_appdf(form["file"].file)
+        except Exception as e:
+            return self._answer(200, self._result("wrong-appdf-format", str(e)))
+        code, app = self.server.store.submit(package, apk_hash, activate)
+        self._answer(200, self._result(code, "", package, app["version"]))
+
+    def _result(self, code, message, package="", version=""):
+        return {"code": code, "message": message, "package": package,
+                "version": str(version)}
+
+    def _authorized(self):
+        options = self.server.options
+        if not options.username:
+            return True
+        expected = base64.b64encode("{}:{}".format(options.username, options.password))
+        return self.headers.get("Authorization") == "Basic " + expected
+
+    def _skip_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 1 << 16)))
+
+    def _answer(self, status, result, headers=None):
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.options.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MockStoreServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, options):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.options = options
+        self.store = Store(options.approval_delay)
+
+
+def parse_args(args=None):
+    argument_parser = argparse.ArgumentParser(description="Mock AppDF store")
+    argument_parser.add_argument("--host", default="127.0.0.1", help="Address to listen")
+    argument_parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                                 help="Port to listen, 0 for any free port")
+    argument_parser.add_argument("--username", help="Require basic authorization")
+    argument_parser.add_argument("--password", default="", help="Password")
+    argument_parser.add_argument("--latency", type=float, default=0,
+                                 help="Mean delay of an answer in seconds")
+    argument_parser.add_argument("--jitter", type=float, default=0,
+                                 help="Standard deviation of the delay")
+    argument_parser.add_argument("--error-rate", type=float, default=0,
+                                 help="Fraction of requests answered with 503")
+    argument_parser.add_argument("--drop-rate", type=float, default=0,
+                                 help="Fraction of connections closed without answer")
+    argument_parser.add_argument("--approval-delay", type=float, default=0,
+                                 help="Seconds a submitted application waits for approval")
+    argument_parser.add_argument("--quiet", "-q", action="store_true",
+                                 help="Do not log requests")
+    return argument_parser.parse_args(args)
+
+
+def main():
+    options = parse_args()
+    server = MockStoreServer((options.host, options.port), options)
+    print "Mock store at http://{}:{}".format(*server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
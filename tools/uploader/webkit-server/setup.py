@@ -31,7 +31,7 @@ setup(name='webkit-server',
       author_email='niklas.baumstark@gmail.com',
       license='MIT',
       url='https://github.com/niklasb/webkit-server',
-      py_modules=['webkit_server'],
+      py_modules=['webkit_server', 'webkit_server_loop'],
       cmdclass={
         'build': build_server,
       },
@@ -0,0 +1,99 @@
+""" Tests of webkit_server_loop over socket pairs standing in for Webkit
+servers, run by `python -m unittest test_webkit_server_loop` from this
+directory """
+import socket
+import unittest
+from webkit_server import NoResponseError, InvalidResponseError, EndOfStreamError
+from webkit_server_loop import Loop, AsyncServerConnection, gather
+
+
+class FakeServer(object):
+    """ Hands one end of a socket pair to the connection, the test plays the
+    server on the other end """
+
+    def __init__(self):
+        self.client, self.peer = socket.socketpair()
+
+    def connect(self):
+        return self.client
+
+    def received(self):
+        self.peer.setblocking(0)
+        data = ""
+        try:
+            while True:
+                chunk = self.peer.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.error:
+            pass
+        return data
+
+
+def response(message, status = "ok"):
+    return "{}\n{}\n{}".format(status, len(message), message)
+
+
+class AsyncServerConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = Loop()
+
+    def connect(self):
+        server = FakeServer()
+        self.addCleanup(server.peer.close)
+        return AsyncServerConnection(self.loop, server), server
+
+    def test_pipelining(self):
+        connection, server = self.connect()
+        futures = [connection.issue_command("Visit", "http://example.com"),
+                   connection.issue_command("Body"),
+                   connection.issue_command("Find", "//a")]
+        server.peer.sendall(response("") + response("<html/>") +
+                            response("bad xpath", "failure"))
+        results = self.loop.run_until_complete(gather(futures, return_exceptions = True))
+        self.assertEqual(results[:2], ["", "<html/>"])
+        self.assertIsInstance(results[2], InvalidResponseError)
+        self.assertEqual(str(results[2]), "bad xpath")
+        self.assertEqual(server.received(),
+                         "Visit\n1\n18\nhttp://example.com"
+                         "Body\n0\n"
+                         "Find\n1\n3\n//a")
+
+    def test_split_reads(self):
+        connection, server = self.connect()
+        futures = [connection.issue_command("Body"), connection.issue_command("Url")]
+        data = response("x" * 100) + response("http://example.com")
+        # Responses arrive a byte at a time
+        for i, byte in enumerate(data):
+            self.loop.call_later(0.001 * i, server.peer.send, byte)
+        results = self.loop.run_until_complete(gather(futures))
+        self.assertEqual(results, ["x" * 100, "http://example.com"])
+
+    def test_failures_stay_in_connection(self):
+        good, good_server = self.connect()
+        no_response, no_response_server = self.connect()
+        bad_size, bad_size_server = self.connect()
+        closed, closed_server = self.connect()
+        futures = [good.issue_command("Body"),
+                   no_response.issue_command("Body"),
+                   no_response.issue_command("Url"),
+                   bad_size.issue_command("Body"),
+                   closed.issue_command("Body")]
+        no_response_server.peer.sendall("\n0\n")
+        bad_size_server.peer.sendall("ok\nabc\n")
+        closed_server.peer.shutdown(socket.SHUT_WR)
+        self.loop.call_later(0.05, good_server.peer.sendall, response("<html/>"))
+        results = self.loop.run_until_complete(gather(futures, return_exceptions = True))
+        self.assertEqual(results[0], "<html/>")
+        self.assertIsInstance(results[1], NoResponseError)
+        self.assertIsInstance(results[2], NoResponseError)
+        self.assertIsInstance(results[3], ValueError)
+        self.assertIsInstance(results[4], EndOfStreamError)
+        # Failed connections are closed and refuse new commands
+        future = no_response.issue_command("Body")
+        self.assertIsInstance(future.exception(), EndOfStreamError)
+
+
+if __name__ == "__main__":
+    unittest.main()
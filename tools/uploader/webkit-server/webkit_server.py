@@ -13,6 +13,9 @@ import time
 # path to the `webkit_server` executable
 SERVER_EXEC = os.path.abspath(os.path.join(sys.prefix, 'qtbin', 'webkit_server'))
 
+# browser identity sent with every request of a new session
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/31.0.1650.57 Safari/537.36"
+
 class SelectionMixin(object):
     """ Implements a generic XPath selection for a class providing a
     ``_get_xpath_ids`` and a ``get_node_factory`` method. """
@@ -58,6 +61,64 @@ class SelectionMixin(object):
 DEFAULT_WAIT_INTERVAL = 0.5
 DEFAULT_WAIT_TIMEOUT = 10
 DEFAULT_AT_TIMEOUT = 5
+# first pause between checks, doubled up to the wait interval
+DEFAULT_MIN_WAIT_INTERVAL = 0.02
+# how long the DOM must stay unchanged to be considered idle
+DEFAULT_IDLE_QUIET = 0.3
+
+# Installs a MutationObserver and a load event hook into the page (once per
+# document) and returns a token which changes whenever the DOM changes or
+# another document is loaded. Returns null if MutationObserver is unsupported.
+DOM_TOKEN_SCRIPT = """(function() {
+    var Observer = window.MutationObserver || window.WebKitMutationObserver;
+    if (!Observer) {
+        return null;
+    }
+    var state = window.__webkitServerDomState;
+    if (!state) {
+        state = window.__webkitServerDomState = {id: Math.random(), count: 0};
+        var changed = function() { state.count++; };
+        new Observer(changed).observe(document, {childList: true, subtree: true,
+            attributes: true, characterData: true});
+        window.addEventListener("load", changed, false);
+    }
+    return state.id + ":" + state.count;
+})()"""
+
+# Sets values of many fields and fires their change events. Takes a list of
+# [xpath, node id, value] triples (either xpath or node id is null) and
+# returns a list telling which fields were found.
+FILL_SCRIPT = """(function(fields) {
+    var results = [];
+    for (var i = 0; i < fields.length; i++) {
+        var node = fields[i][0] === null ? Capybara.nodes[fields[i][1]] :
+            document.evaluate(fields[i][0], document, null,
+                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        if (!node) {
+            results.push(false);
+            continue;
+        }
+        node.value = fields[i][2];
+        var event = document.createEvent("HTMLEvents");
+        event.initEvent("change", true, true);
+        node.dispatchEvent(event);
+        results.push(true);
+    }
+    return results;
+})(%s)"""
+
+def fill_script(fields):
+    """ Returns ``FILL_SCRIPT`` for a list of ``(field, value)`` pairs where
+    a field is an XPath expression or a node. """
+    args = []
+    for field, value in fields:
+        if not isinstance(value, basestring):
+            value = str(value)
+        if isinstance(field, basestring):
+            args.append([field, None, value])
+        else:
+            args.append([None, field.node_id, value])
+    return FILL_SCRIPT % json.dumps(args)
 
 class WaitTimeoutError(Exception):
     """ Raised when a wait times out """
@@ -69,10 +130,15 @@ class WaitMixin(SelectionMixin):
                 condition,
                 interval = DEFAULT_WAIT_INTERVAL,
                 timeout = DEFAULT_WAIT_TIMEOUT):
-        """ Wait until a condition holds by checking it in regular intervals.
+        """ Wait until a condition holds. After a failed check the condition is
+        checked again as soon as the DOM changes (watched by a MutationObserver
+        installed into the page) and at least every `interval` seconds anyway.
+        Pauses between polls of the DOM start short and grow up to `interval`.
         Raises ``WaitTimeoutError`` on timeout. """
 
         start = time.time()
+        token = None
+        pause = min(DEFAULT_MIN_WAIT_INTERVAL, interval)
 
         # at least execute the check once!
         while True:
@@ -82,15 +148,59 @@ class WaitMixin(SelectionMixin):
                     return res
             except Exception as e:
                 print e
-            # timeout?
-            if time.time() - start > timeout:
-                break
-
-            # wait a bit
-            time.sleep(interval)
-
-        # timeout occured!
-        raise WaitTimeoutError, "wait_for timed out"
+            last_check = time.time()
+            if token is None:
+                token = self._dom_token()
+
+            # wait until the DOM changes or the interval passes
+            while True:
+                # timeout?
+                if time.time() - start > timeout:
+                    # timeout occured!
+                    raise WaitTimeoutError, "wait_for timed out"
+
+                # wait a bit
+                time.sleep(pause)
+                new_token = self._dom_token()
+                if new_token is not None and new_token != token:
+                    token = new_token
+                    pause = min(DEFAULT_MIN_WAIT_INTERVAL, interval)
+                    break
+                pause = min(pause * 2, interval)
+                # without DOM token fall back to polling with backoff
+                if new_token is None or time.time() - last_check >= interval:
+                    break
+
+    def wait_for_idle(self,
+                quiet = DEFAULT_IDLE_QUIET,
+                timeout = DEFAULT_WAIT_TIMEOUT):
+        """ Wait until the DOM has not changed for `quiet` seconds. Returns
+        ``False`` on timeout. """
+        start = time.time()
+        token = self._dom_token()
+        changed_at = time.time()
+        pause = min(DEFAULT_MIN_WAIT_INTERVAL, quiet)
+        while time.time() - start <= timeout:
+            time.sleep(pause)
+            new_token = self._dom_token()
+            if new_token != token:
+                token = new_token
+                changed_at = time.time()
+                pause = min(DEFAULT_MIN_WAIT_INTERVAL, quiet)
+            elif time.time() - changed_at >= quiet:
+                return True
+            else:
+                pause = min(pause * 2, quiet)
+        return False
+
+    def _dom_token(self):
+        """ Returns a token changing with every DOM mutation (see
+        ``DOM_TOKEN_SCRIPT``) or ``None`` if it cannot be obtained. """
+        client = getattr(self, "client", self)
+        try:
+            return client.eval_script(DOM_TOKEN_SCRIPT)
+        except Exception:
+            return None
 
     def wait_for_safe(self, *args, **kw):
         """ Wait until a condition holds and return
@@ -313,7 +423,7 @@ class Client(WaitMixin):
         super(Client, self).__init__()
         self.conn = connection or ServerConnection()
         self._node_factory = node_factory_class(self)
-        self.set_header("User-Agent", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/31.0.1650.57 Safari/537.36")
+        self.set_header("User-Agent", DEFAULT_USER_AGENT)
 
     def visit(self, url):
         """ Goes to a given URL. """
@@ -392,6 +502,63 @@ class Client(WaitMixin):
         """ Issues a node-specific command. """
         return self.conn.issue_command("Node", *args)
 
+    def batch(self):
+        """ Returns a new ``CommandBatch`` bound to this client. """
+        return CommandBatch(self)
+
+    def xpath_many(self, xpaths):
+        """ Finds nodes for every XPath expression in a single round trip.
+        Returns a list of node lists. """
+        batch = self.batch()
+        for xpath in xpaths:
+            batch.add("FindXpath", xpath)
+        return [self._create_nodes(ids) for ids in batch.flush()]
+
+    def nodes_invoke(self, nodes, cmd, *args):
+        """ Issues the same node command for every node in a single round trip.
+        Returns a list of results. """
+        batch = self.batch()
+        for node in nodes:
+            batch.add_node(node, cmd, *args)
+        return batch.flush()
+
+    def nodes_attr(self, nodes, name):
+        """ Returns values of an attribute of every node. """
+        return self.nodes_invoke(nodes, "attribute", name)
+
+    def nodes_text(self, nodes):
+        """ Returns inner text of every node. """
+        return self.nodes_invoke(nodes, "text")
+
+    def nodes_at_xpath(self, nodes, xpath):
+        """ Returns the first node matching the relative XPath expression (or
+        ``None``) for every node. """
+        return [self._first_or_none(self._create_nodes(ids))
+                for ids in self.nodes_invoke(nodes, "findXpathWithin", xpath)]
+
+    def click_all(self, nodes):
+        """ Clicks every node (see ``Node.click``) in a single round trip. """
+        batch = self.batch()
+        for node in nodes:
+            batch.add("Execute", node._build_script("node.click()"))
+        batch.flush()
+
+    def fill_many(self, fields):
+        """ Sets values of many fields and fires their ``change`` events in a
+        single script. `fields` is a mapping or a list of pairs of an XPath
+        expression (or a node) and a value, pairs are filled in order. Returns
+        a list of booleans telling which fields were found. """
+        if hasattr(fields, "items"):
+            fields = fields.items()
+        if not fields:
+            return []
+        return self.eval_script(fill_script(fields))
+
+    def _create_nodes(self, ids):
+        return [self.get_node_factory().create(node_id)
+                for node_id in ids.split(",")
+                if node_id]
+
     def get_node_factory(self):
         """ Returns the associated node factory. """
         return self._node_factory
@@ -411,6 +578,42 @@ class Client(WaitMixin):
         return ''.join(x.capitalize() for x in attr.split("_"))
 
 
+class CommandBatch(object):
+    """ Queues commands and sends them to the server in a single pipelined write,
+    then reads all responses back in order.
+
+    The server starts every command as soon as it is parsed, so only commands
+    which finish without waiting for a page load (node queries, attribute reads,
+    simple scripts) should be batched. """
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def add(self, cmd, *args):
+        """ Queues a command, returns its index in the results of ``flush``. """
+        self._commands.append((cmd, ) + args)
+        return len(self._commands) - 1
+
+    def add_node(self, node, cmd, *args):
+        """ Queues a node-specific command. """
+        return self.add("Node", cmd, node.node_id, *args)
+
+    def flush(self):
+        """ Sends queued commands and returns a list of their results. Raises
+        ``InvalidResponseError`` of the first failed command after all responses
+        have been read. """
+        commands, self._commands = self._commands, []
+        results = self.client.conn.issue_commands(commands)
+        for result in results:
+            if isinstance(result, InvalidResponseError):
+                raise result
+        return results
+
+    def __len__(self):
+        return len(self._commands)
+
+
 class NoX11Error(Exception):
     """ Raised when the Webkit server cannot connect to X. """
 
@@ -434,9 +637,10 @@ class Server(object):
         atexit.register(self.kill)
 
     def kill(self):
-        """ Kill the process. """
-        self._server.kill()
-        self._server.wait()
+        """ Kill the process (if it is still running). """
+        if self._server.poll() is None:
+            self._server.kill()
+            self._server.wait()
 
     def connect(self):
         """ Returns a new socket connection to this server. """
@@ -463,26 +667,74 @@ class InvalidResponseError(Exception):
 class EndOfStreamError(Exception):
     """ Raised when the Webkit server closed the connection unexpectedly. """
 
+# size of a single read from the server socket
+RECV_BUFFER_SIZE = 65536
+
 class ServerConnection(object):
     """ A connection to a Webkit server.
 
     `server` is a server instance or `None` if a singleton server should be connected
-    to (will be started if necessary). """
+    to (will be started if necessary).
+
+    Socket I/O is buffered: every command is sent with a single write and
+    responses are read in large chunks. ``stats`` holds totals of sent and received
+    bytes and socket calls, ``last_command_stats`` the same for the last command. """
+
+    STATS_KEYS = ("commands", "bytes_sent", "bytes_received", "send_calls", "recv_calls")
 
     def __init__(self, server = None):
         super(ServerConnection, self).__init__()
         self._sock = (server or get_default_server()).connect()
+        self._buffer = ""
+        self.stats = dict.fromkeys(self.STATS_KEYS, 0)
+        self.last_command_stats = dict.fromkeys(self.STATS_KEYS, 0)
 
     def issue_command(self, cmd, *args):
         """ Sends and receives a message to/from the server """
-        self._writeline(cmd)
-        self._writeline(str(len(args)))
+        self.last_command_stats = dict.fromkeys(self.STATS_KEYS, 0)
+        self.last_command_stats["commands"] = 1
+        try:
+            self._send(self._build_command(cmd, *args))
+            return self._read_response()
+        finally:
+            for key, value in self.last_command_stats.iteritems():
+                self.stats[key] += value
+
+    def issue_commands(self, commands):
+        """ Sends several commands (tuples of command name and arguments) in a
+        single write and reads their responses in order. Returns a list of
+        results where a failed command is represented by an
+        ``InvalidResponseError`` instance. """
+        if not commands:
+            return []
+        self.last_command_stats = dict.fromkeys(self.STATS_KEYS, 0)
+        self.last_command_stats["commands"] = len(commands)
+        try:
+            self._send("".join(self._build_command(*command) for command in commands))
+            results = []
+            for command in commands:
+                try:
+                    results.append(self._read_response())
+                except InvalidResponseError as e:
+                    results.append(e)
+            return results
+        finally:
+            for key, value in self.last_command_stats.iteritems():
+                self.stats[key] += value
+
+    def _build_command(self, cmd, *args):
+        """ Serializes a command with its arguments into a single packet """
+        packet = [cmd, "\n", str(len(args)), "\n"]
         for arg in args:
             arg = str(arg)
-            self._writeline(str(len(arg)))
-            self._sock.send(arg)
+            packet.extend([str(len(arg)), "\n", arg])
+        return "".join(packet)
 
-        return self._read_response()
+    def _send(self, data):
+        """ Writes the whole packet to the underlying socket at once. """
+        self._sock.sendall(data)
+        self.last_command_stats["send_calls"] += 1
+        self.last_command_stats["bytes_sent"] += len(data)
 
     def _read_response(self):
         """ Reads a complete response packet from the server """
@@ -503,28 +755,42 @@ class ServerConnection(object):
         else:
             return self._recvall(size)
 
+    def _recv(self):
+        """ Reads the next chunk from the socket, raises ``EndOfStreamError`` on
+        EOF. """
+        data = self._sock.recv(RECV_BUFFER_SIZE)
+        self.last_command_stats["recv_calls"] += 1
+        if not data:
+            raise EndOfStreamError, "Unexpected end of stream."
+        self.last_command_stats["bytes_received"] += len(data)
+        return data
+
     def _recvall(self, size):
         """ Receive until the given number of bytes is fetched or until EOF (in which
         case ``EndOfStreamError`` is raised). """
-        result = []
-        while size > 0:
-            data = self._sock.recv(min(8192, size))
-            if not data:
-                raise EndOfStreamError, "Unexpected end of stream."
+        result = [self._buffer[:size]]
+        received = len(result[0])
+        self._buffer = self._buffer[size:]
+        while received < size:
+            data = self._recv()
             result.append(data)
-            size -= len(data)
+            received += len(data)
+        if received > size:
+            # keep the beginning of the next message
+            extra = received - size
+            self._buffer = result[-1][-extra:]
+            result[-1] = result[-1][:-extra]
         return ''.join(result)
 
     def _readline(self):
-        """ Cheap implementation of a readline function that operates on our underlying
-        socket. """
-        res = []
+        """ Reads a line from the buffer, refilling it from the socket when
+        needed. """
+        start = 0
         while True:
-            c = self._sock.recv(1)
-            if c == "\n":
-                return "".join(res)
-            res.append(c)
-
-    def _writeline(self, line):
-        """ Writes a line to the underlying socket. """
-        self._sock.send(line + "\n")
+            index = self._buffer.find("\n", start)
+            if index >= 0:
+                line = self._buffer[:index]
+                self._buffer = self._buffer[index + 1:]
+                return line
+            start = len(self._buffer)
+            self._buffer += self._recv()
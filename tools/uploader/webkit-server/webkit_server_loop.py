@@ -0,0 +1,770 @@
+"""
+Event loop driven bindings for the `webkit-server <https://github.com/niklasb/webkit-server/>`_
+
+A single thread drives many browser sessions over non-blocking sockets. Code
+using them is written as generator based coroutines: ``yield`` a command, a
+coroutine, a list of them or ``sleep(seconds)`` to get its result, and
+``raise Return(value)`` to return a value from a coroutine::
+
+    def title(client, url):
+        yield client.visit(url)
+        node = yield client.at_xpath("//title")
+        raise Return((yield node.text()))
+
+    loop = Loop()
+    clients = [AsyncClient(loop, Server()) for i in range(10)]
+    titles = loop.run_until_complete([title(client, url) for client in clients])
+
+Every session needs a server process of its own, since a server shares one
+page between all its connections.
+"""
+
+import time
+import json
+import heapq
+import errno
+import select
+import socket
+import collections
+import types
+
+from webkit_server import (get_default_server, DEFAULT_USER_AGENT,
+    DEFAULT_WAIT_INTERVAL, DEFAULT_WAIT_TIMEOUT, DEFAULT_AT_TIMEOUT,
+    DEFAULT_MIN_WAIT_INTERVAL, DEFAULT_IDLE_QUIET, DOM_TOKEN_SCRIPT,
+    RECV_BUFFER_SIZE, fill_script, WaitTimeoutError, NodeError,
+    NoResponseError, InvalidResponseError, EndOfStreamError)
+
+
+class Return(Exception):
+    """ Raised by a coroutine to return `value` (generators of Python 2
+    cannot return values). """
+
+    def __init__(self, value = None):
+        super(Return, self).__init__()
+        self.value = value
+
+
+class Future(object):
+    """ Result of an operation which is not finished yet. """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        """ Returns the result or raises the exception of a finished future. """
+        if not self._done:
+            raise RuntimeError("Future is not finished")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        return self._exception
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def add_done_callback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _finish(self, result, exception):
+        if self._done:
+            return
+        self._done = True
+        self._result = result
+        self._exception = exception
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def gather(futures, return_exceptions = False):
+    """ Returns a future of the list of results of all futures. With
+    `return_exceptions` exceptions are put into the list instead of failing
+    the whole future. """
+    result = Future()
+    futures = list(futures)
+    if not futures:
+        result.set_result([])
+        return result
+    left = [len(futures)]
+
+    def finished(future):
+        if result.done():
+            return
+        if future.exception() is not None and not return_exceptions:
+            result.set_exception(future.exception())
+            return
+        left[0] -= 1
+        if left[0] == 0:
+            result.set_result([future.exception() if future.exception() is not None
+                               else future.result() for future in futures])
+
+    for future in futures:
+        future.add_done_callback(finished)
+    return result
+
+
+class sleep(object):
+    """ Yielded by a coroutine to pause for `seconds`. """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Task(Future):
+    """ Runs a generator based coroutine in the loop, finishes with the value
+    it returns. """
+
+    def __init__(self, loop, coroutine):
+        super(Task, self).__init__()
+        self.loop = loop
+        self._coroutine = coroutine
+        loop.call_soon(self._step, None, None)
+
+    def _step(self, value, exception):
+        try:
+            if exception is not None:
+                yielded = self._coroutine.throw(exception)
+            else:
+                yielded = self._coroutine.send(value)
+        except StopIteration:
+            self.set_result(None)
+        except Return as e:
+            self.set_result(e.value)
+        except Exception as e:
+            self.set_exception(e)
+        else:
+            try:
+                future = self.loop.as_future(yielded)
+            except TypeError as e:
+                self.loop.call_soon(self._step, None, e)
+            else:
+                future.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        self.loop.call_soon(self._step, future._result, future._exception)
+
+
+class Loop(object):
+    """ Select based event loop running coroutines and socket I/O of
+    ``AsyncServerConnection`` instances. """
+
+    def __init__(self):
+        self._ready = collections.deque()
+        self._timers = []
+        self._timer_count = 0
+        self._connections = {}
+
+    def call_soon(self, callback, *args):
+        self._ready.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        self._timer_count += 1
+        heapq.heappush(self._timers, (time.time() + delay, self._timer_count,
+                                      callback, args))
+
+    def spawn(self, coroutine):
+        """ Starts a coroutine, returns its ``Task``. """
+        return Task(self, coroutine)
+
+    def as_future(self, value):
+        """ Converts anything a coroutine may yield to a future. """
+        if isinstance(value, Future):
+            return value
+        if isinstance(value, types.GeneratorType):
+            return Task(self, value)
+        if isinstance(value, (list, tuple)):
+            return gather(self.as_future(item) for item in value)
+        if isinstance(value, sleep):
+            future = Future()
+            self.call_later(value.seconds, future.set_result, None)
+            return future
+        raise TypeError("Cannot wait for %r" % (value, ))
+
+    def run_until_complete(self, value):
+        """ Runs the loop until the coroutine, future or list of them is
+        finished, returns the result. """
+        future = self.as_future(value)
+        while not future.done():
+            self._run_once()
+        return future.result()
+
+    def add_connection(self, connection):
+        self._connections[connection.fileno()] = connection
+
+    def remove_connection(self, connection):
+        self._connections.pop(connection.fileno(), None)
+
+    def _run_once(self):
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, self._timers[0][0] - time.time())
+        elif any(connection.waiting() for connection in self._connections.values()):
+            timeout = None
+        else:
+            raise RuntimeError("Nothing to wait for, the loop would block forever")
+
+        readers = [fd for fd, connection in self._connections.items()
+                   if connection.waiting()]
+        writers = [fd for fd, connection in self._connections.items()
+                   if connection.writing()]
+        if readers or writers:
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+            for fd in writable:
+                self._connections[fd].handle_write()
+            for fd in readable:
+                if fd in self._connections:
+                    self._connections[fd].handle_read()
+        elif timeout:
+            time.sleep(timeout)
+
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            self._ready.append((callback, args))
+
+        for i in xrange(len(self._ready)):
+            callback, args = self._ready.popleft()
+            callback(*args)
+
+
+class AsyncServerConnection(object):
+    """ A non-blocking connection to a Webkit server driven by `loop`.
+    Commands are queued and written as soon as the socket accepts them,
+    responses are matched to commands in order, so any number of commands
+    may be in flight. """
+
+    STATS_KEYS = ("commands", "bytes_sent", "bytes_received", "send_calls", "recv_calls")
+
+    def __init__(self, loop, server = None):
+        super(AsyncServerConnection, self).__init__()
+        self.loop = loop
+        self._sock = (server or get_default_server()).connect()
+        self._sock.setblocking(0)
+        self._out = ""
+        self._buffer = ""
+        self._pending = collections.deque()
+        self.stats = dict.fromkeys(self.STATS_KEYS, 0)
+        loop.add_connection(self)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def issue_command(self, cmd, *args):
+        """ Queues a command, returns a future of its response. """
+        future = Future()
+        if self._sock is None:
+            future.set_exception(EndOfStreamError("Connection is closed."))
+            return future
+        self._out += self._build_command(cmd, *args)
+        self._pending.append(future)
+        self.stats["commands"] += 1
+        return future
+
+    def issue_commands(self, commands):
+        """ Queues several commands, returns a future of the list of results
+        where a failed command is represented by an ``InvalidResponseError``
+        instance. """
+        return gather([self.issue_command(*command) for command in commands],
+                      return_exceptions = True)
+
+    def _build_command(self, cmd, *args):
+        """ Serializes a command with its arguments into a single packet """
+        packet = [cmd, "\n", str(len(args)), "\n"]
+        for arg in args:
+            arg = str(arg)
+            packet.extend([str(len(arg)), "\n", arg])
+        return "".join(packet)
+
+    def waiting(self):
+        return bool(self._pending)
+
+    def writing(self):
+        return bool(self._out)
+
+    def handle_write(self):
+        try:
+            sent = self._sock.send(self._out)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            return self._fail(e)
+        self.stats["send_calls"] += 1
+        self.stats["bytes_sent"] += sent
+        self._out = self._out[sent:]
+
+    def handle_read(self):
+        try:
+            data = self._sock.recv(RECV_BUFFER_SIZE)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            return self._fail(e)
+        self.stats["recv_calls"] += 1
+        if not data:
+            return self._fail(EndOfStreamError("Unexpected end of stream."))
+        self.stats["bytes_received"] += len(data)
+        self._buffer += data
+        while self._pending:
+            try:
+                response = self._parse_response()
+            except (NoResponseError, ValueError) as e:
+                # The stream cannot be parsed further, only commands of this
+                # connection fail
+                return self._fail(e)
+            if response is None:
+                break
+            ok, message = response
+            future = self._pending.popleft()
+            if ok:
+                future.set_result(message)
+            else:
+                future.set_exception(InvalidResponseError(message))
+
+    def _parse_response(self):
+        """ Takes a complete response from the buffer, returns ``(ok,
+        message)`` or ``None`` if more data is needed. """
+        status_end = self._buffer.find("\n")
+        if status_end < 0:
+            return None
+        size_end = self._buffer.find("\n", status_end + 1)
+        if size_end < 0:
+            return None
+        status = self._buffer[:status_end]
+        if not status:
+            raise NoResponseError("No response received from server.")
+        size = int(self._buffer[status_end + 1:size_end])
+        if len(self._buffer) < size_end + 1 + size:
+            return None
+        message = self._buffer[size_end + 1:size_end + 1 + size]
+        self._buffer = self._buffer[size_end + 1 + size:]
+        return status == "ok", message
+
+    def _fail(self, exception):
+        self.close()
+        self._buffer = ""
+        pending, self._pending = self._pending, collections.deque()
+        for future in pending:
+            future.set_exception(exception)
+
+    def close(self):
+        if self._sock is not None:
+            self.loop.remove_connection(self)
+            self._sock.close()
+            self._sock = None
+        self._out = ""
+
+
+def _then(future, function):
+    """ Returns a future of `function` applied to the result of `future`. """
+    result = Future()
+
+    def finished(future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            try:
+                result.set_result(function(future.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+    future.add_done_callback(finished)
+    return result
+
+
+class AsyncSelectionMixin(object):
+    """ Awaitable counterpart of ``webkit_server.SelectionMixin``. """
+
+    def css(self, css):
+        """ Returns all nodes matching the given CSSv3 expression. """
+        return _then(self._get_css_ids(css), self._create_nodes)
+
+    def at_css(self, css):
+        """ Returns the first node matching the given CSSv3
+        expression or ``None``. """
+        return _then(self.css(css), self._first_or_none)
+
+    def at_xpath(self, xpath):
+        """ Returns the first node matching the given XPath 2.0 expression or ``None``.
+        """
+        return _then(self.xpath(xpath), self._first_or_none)
+
+    def xpath(self, xpath):
+        """ Finds another node by XPath originating at the current node. """
+        return _then(self._get_xpath_ids(xpath), self._create_nodes)
+
+    def parent(self):
+        """ Returns the parent node. """
+        return self.at_xpath('..')
+
+    def children(self):
+        """ Returns the child nodes. """
+        return self.xpath('*')
+
+    def form(self):
+        """ Returns the form wherein this node is contained or ``None``. """
+        return self.at_xpath("ancestor::form")
+
+    def _create_nodes(self, ids):
+        return [self.get_node_factory().create(node_id)
+                for node_id in ids.split(",")
+                if node_id]
+
+    def _first_or_none(self, list):
+        return list[0] if list else None
+
+
+class AsyncWaitMixin(AsyncSelectionMixin):
+    """ Awaitable counterpart of ``webkit_server.WaitMixin``. Conditions may
+    return a value, a future or a coroutine. """
+
+    def wait_for(self,
+                condition,
+                interval = DEFAULT_WAIT_INTERVAL,
+                timeout = DEFAULT_WAIT_TIMEOUT):
+        """ Wait until a condition holds. The condition is checked again as
+        soon as the DOM changes and at least every `interval` seconds.
+        Raises ``WaitTimeoutError`` on timeout. """
+        loop = self._client().loop
+        start = time.time()
+        token = None
+        pause = min(DEFAULT_MIN_WAIT_INTERVAL, interval)
+
+        while True:
+            try:
+                res = condition()
+                if not isinstance(res, (bool, basestring, int, long, float, type(None))):
+                    res = yield loop.as_future(res)
+                if res:
+                    raise Return(res)
+            except (Return, WaitTimeoutError):
+                raise
+            except Exception as e:
+                print e
+            last_check = time.time()
+            if token is None:
+                token = yield self._dom_token()
+
+            # wait until the DOM changes or the interval passes
+            while True:
+                if time.time() - start > timeout:
+                    raise WaitTimeoutError, "wait_for timed out"
+                yield sleep(pause)
+                new_token = yield self._dom_token()
+                if new_token is not None and new_token != token:
+                    token = new_token
+                    pause = min(DEFAULT_MIN_WAIT_INTERVAL, interval)
+                    break
+                pause = min(pause * 2, interval)
+                if new_token is None or time.time() - last_check >= interval:
+                    break
+
+    def wait_for_idle(self,
+                quiet = DEFAULT_IDLE_QUIET,
+                timeout = DEFAULT_WAIT_TIMEOUT):
+        """ Wait until the DOM has not changed for `quiet` seconds. Returns
+        ``False`` on timeout. """
+        start = time.time()
+        token = yield self._dom_token()
+        changed_at = time.time()
+        pause = min(DEFAULT_MIN_WAIT_INTERVAL, quiet)
+        while time.time() - start <= timeout:
+            yield sleep(pause)
+            new_token = yield self._dom_token()
+            if new_token != token:
+                token = new_token
+                changed_at = time.time()
+                pause = min(DEFAULT_MIN_WAIT_INTERVAL, quiet)
+            elif time.time() - changed_at >= quiet:
+                raise Return(True)
+            else:
+                pause = min(pause * 2, quiet)
+        raise Return(False)
+
+    def _dom_token(self):
+        """ Returns a token changing with every DOM mutation or ``None``. """
+        try:
+            raise Return((yield self._client().eval_script(DOM_TOKEN_SCRIPT)))
+        except InvalidResponseError:
+            raise Return(None)
+
+    def wait_for_safe(self, *args, **kw):
+        """ Wait until a condition holds and return
+        ``None`` on timeout. """
+        try:
+            raise Return((yield self.wait_for(*args, **kw)))
+        except WaitTimeoutError:
+            raise Return(None)
+
+    def wait_while(self, condition, *args, **kw):
+        """ Wait while a condition holds. """
+        loop = self._client().loop
+
+        def negated():
+            res = yield loop.as_future(condition())
+            raise Return(not res)
+
+        return self.wait_for(negated, *args, **kw)
+
+    def at_css(self, css, timeout = DEFAULT_AT_TIMEOUT, **kw):
+        """ Returns the first node matching the given CSSv3 expression or ``None``
+        if a timeout occurs. """
+        return self.wait_for_safe(lambda: super(AsyncWaitMixin, self).at_css(css),
+                                  timeout = timeout, **kw)
+
+    def at_xpath(self, xpath, timeout = DEFAULT_AT_TIMEOUT, **kw):
+        """ Returns the first node matching the given XPath 2.0 expression or ``None``
+        if a timeout occurs. """
+        return self.wait_for_safe(lambda: super(AsyncWaitMixin, self).at_xpath(xpath),
+                                  timeout = timeout, **kw)
+
+
+class AsyncNodeFactory(object):
+    """ Creates ``AsyncNode`` instances of `client`. """
+
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, node_id):
+        return AsyncNode(self.client, node_id)
+
+
+class AsyncNode(AsyncWaitMixin):
+    """ Awaitable counterpart of ``webkit_server.Node``. """
+
+    def __init__(self, client, node_id):
+        super(AsyncNode, self).__init__()
+        self.client = client
+        self.node_id = node_id
+
+    def _client(self):
+        return self.client
+
+    def text(self):
+        """ Returns the inner text (*not* HTML). """
+        return self._invoke("text")
+
+    def get_bool_attr(self, name):
+        """ Returns the value of a boolean HTML attribute like `checked` or `disabled`
+        """
+        return _then(self.get_attr(name),
+                     lambda val: val is not None and val.lower() in ("true", name))
+
+    def get_attr(self, name):
+        """ Returns the value of an attribute. """
+        return self._invoke("attribute", name)
+
+    def set_attr(self, name, value):
+        """ Sets the value of an attribute. """
+        return self.exec_script("node.setAttribute(%s, %s)" % (repr(name), repr(value)))
+
+    def value(self):
+        """ Returns the node's value. """
+        return self._invoke("value")
+
+    def set(self, value):
+        """ Sets the node content to the given value (e.g. for input fields). """
+        return self._invoke("set", value)
+
+    def path(self):
+        """ Returns an XPath expression that uniquely identifies the current node. """
+        return self._invoke("path")
+
+    def submit(self):
+        """ Submits a form node. """
+        return self.eval_script("node.submit()")
+
+    def eval_script(self, js):
+        """ Evaluate arbitrary Javascript with the ``node`` variable bound to the
+        current node. """
+        return self.client.eval_script(self._build_script(js))
+
+    def exec_script(self, js):
+        """ Execute arbitrary Javascript with the ``node`` variable bound to
+        the current node. """
+        return self.client.exec_script(self._build_script(js))
+
+    def _build_script(self, js):
+        return "var node = Capybara.nodes[%s]; %s;" % (self.node_id, js)
+
+    def select_option(self):
+        """ Selects an option node. """
+        return self._invoke("selectOption")
+
+    def click(self):
+        return self.exec_script("node.click()")
+
+    def left_click(self):
+        """ Left click the current node. """
+        return self._invoke("leftClick")
+
+    def double_click(self):
+        """ Double click the current node. """
+        return self._invoke("doubleClick")
+
+    def tag_name(self):
+        """ Returns the tag name of the current node. """
+        return self._invoke("tagName")
+
+    def is_visible(self):
+        """ Checks whether the current node is visible. """
+        return _then(self._invoke("visible"), lambda res: res == "true")
+
+    def is_attached(self):
+        """ Checks whether the current node is actually existing on the currently
+        active web page. """
+        return _then(self._invoke("isAttached"), lambda res: res == "true")
+
+    def is_checked(self):
+        """ is the ``checked`` attribute set for this node? """
+        return self.get_bool_attr("checked")
+
+    def is_disabled(self):
+        """ is the ``disabled`` attribute set for this node? """
+        return self.get_bool_attr("disabled")
+
+    def _get_css_ids(self, css):
+        return self._invoke("findCssWithin", css)
+
+    def _get_xpath_ids(self, xpath):
+        return self._invoke("findXpathWithin", xpath)
+
+    def get_node_factory(self):
+        """ Returns the associated node factory. """
+        return self.client.get_node_factory()
+
+    def __repr__(self):
+        return "<AsyncNode #%s>" % self.node_id
+
+    def _invoke(self, cmd, *args):
+        return self.client.issue_node_cmd(cmd, self.node_id, *args)
+
+
+class AsyncClient(AsyncWaitMixin):
+    """ Awaitable counterpart of ``webkit_server.Client``. Every method
+    returns a future or a coroutine to ``yield`` from a coroutine run by
+    `loop`. `server` is the server of the session. """
+
+    def __init__(self,
+                loop,
+                server = None,
+                connection = None,
+                node_factory_class = AsyncNodeFactory):
+        super(AsyncClient, self).__init__()
+        self.loop = loop
+        self.conn = connection or AsyncServerConnection(loop, server)
+        self._node_factory = node_factory_class(self)
+        self.set_header("User-Agent", DEFAULT_USER_AGENT)
+
+    def _client(self):
+        return self
+
+    def visit(self, url):
+        """ Goes to a given URL. """
+        return self.conn.issue_command("Visit", url)
+
+    def body(self):
+        """ Returns the current DOM as HTML. """
+        return self.conn.issue_command("Body")
+
+    def url(self):
+        """ Returns the current location. """
+        return self.conn.issue_command("CurrentUrl")
+
+    def set_header(self, key, value):
+        """ Sets a HTTP header for future requests. """
+        return self.conn.issue_command("Header", key, value)
+
+    def reset(self):
+        """ Resets the current web session. """
+        return self.conn.issue_command("Reset")
+
+    def status_code(self):
+        """ Returns the numeric HTTP status of the last response. """
+        return _then(self.conn.issue_command("Status"), int)
+
+    def eval_script(self, expr):
+        """ Evaluates a piece of Javascript in the context of the current page and
+        returns its value. """
+        return _then(self.conn.issue_command("Evaluate", expr),
+                     lambda ret: json.loads("[%s]" % ret)[0])
+
+    def exec_script(self, script):
+        """ Executes a piece of Javascript in the context of the current page. """
+        return self.conn.issue_command("Execute", script)
+
+    def render(self, path, width = 1024, height = 1024):
+        """ Renders the current page to a PNG file (viewport size in pixels). """
+        return self.conn.issue_command("Render", path, width, height)
+
+    def set_cookie(self, cookie):
+        """ Sets a cookie for future requests. """
+        return self.conn.issue_command("SetCookie", cookie)
+
+    def clear_cookies(self):
+        """ Deletes all cookies. """
+        return self.conn.issue_command("ClearCookies")
+
+    def cookies(self):
+        """ Returns a list of all cookies in cookie string format. """
+        return _then(self.conn.issue_command("GetCookies"),
+                     lambda ret: [line.strip() for line in ret.split("\n") if line.strip()])
+
+    def set_error_tolerant(self, tolerant=True):
+        """ Sets or unsets the error tolerance flag in the server. """
+        return self.conn.issue_command("SetErrorTolerance", "true" if tolerant else "false")
+
+    def issue_node_cmd(self, *args):
+        """ Issues a node-specific command. """
+        return self.conn.issue_command("Node", *args)
+
+    def xpath_many(self, xpaths):
+        """ Finds nodes for every XPath expression, all queries are in flight
+        at once. Returns a future of a list of node lists. """
+        return gather([self.xpath(xpath) for xpath in xpaths])
+
+    def nodes_invoke(self, nodes, cmd, *args):
+        """ Issues the same node command for every node at once. """
+        return gather([node._invoke(cmd, *args) for node in nodes])
+
+    def click_all(self, nodes):
+        """ Clicks every node at once. """
+        return gather([node.click() for node in nodes])
+
+    def fill_many(self, fields):
+        """ Sets values of many fields in a single script, see
+        ``webkit_server.Client.fill_many``. """
+        if hasattr(fields, "items"):
+            fields = fields.items()
+        if not fields:
+            result = Future()
+            result.set_result([])
+            return result
+        return self.eval_script(fill_script(fields))
+
+    def close(self):
+        self.conn.close()
+
+    def get_node_factory(self):
+        """ Returns the associated node factory. """
+        return self._node_factory
+
+    def _get_css_ids(self, css):
+        return self.conn.issue_command("FindCss", css)
+
+    def _get_xpath_ids(self, xpath):
+        return self.conn.issue_command("FindXpath", xpath)